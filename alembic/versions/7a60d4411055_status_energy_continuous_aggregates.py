@@ -0,0 +1,71 @@
+"""Add hourly and daily energy continuous aggregates
+
+Revision ID: 7a60d4411055
+Revises: 88188d70371d
+Create Date: 2026-10-17 10:03:27.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a60d4411055'
+down_revision: Union[str, None] = '88188d70371d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# name: (query, refresh policy start offset, end offset, schedule interval)
+# Daily and fleet-wide aggregates are built on top of the hourly per unit aggregate,
+# TimescaleDB indexes each aggregate on its GROUP BY columns.
+AGGREGATES = {
+    'status_energy_hourly': (
+        "SELECT unit_id, time_bucket(INTERVAL '1 hour', time) AS bucket, sum(total_energy) AS total_energy "
+        "FROM status GROUP BY unit_id, bucket",
+        '3 days', '1 hour', '30 minutes'
+    ),
+    'status_energy_daily': (
+        "SELECT unit_id, time_bucket(INTERVAL '1 day', bucket) AS bucket, sum(total_energy) AS total_energy "
+        "FROM status_energy_hourly GROUP BY unit_id, 2",
+        '3 days', '1 day', '1 hour'
+    ),
+    'status_energy_fleet_hourly': (
+        "SELECT time_bucket(INTERVAL '1 hour', bucket) AS bucket, sum(total_energy) AS total_energy "
+        "FROM status_energy_hourly GROUP BY 1",
+        '3 days', '1 hour', '30 minutes'
+    ),
+    'status_energy_fleet_daily': (
+        "SELECT time_bucket(INTERVAL '1 day', bucket) AS bucket, sum(total_energy) AS total_energy "
+        "FROM status_energy_fleet_hourly GROUP BY 1",
+        '3 days', '1 day', '1 hour'
+    ),
+}
+
+
+def upgrade() -> None:
+    for name, (query, start_offset, end_offset, schedule) in AGGREGATES.items():
+        # Real-time aggregates: rows not materialised yet are read from the source on query
+        op.execute(
+            f"CREATE MATERIALIZED VIEW {name} "
+            "WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS "
+            f"{query} WITH NO DATA"
+        )
+        op.execute(
+            f"SELECT add_continuous_aggregate_policy('{name}', "
+            f"start_offset => INTERVAL '{start_offset}', "
+            f"end_offset => INTERVAL '{end_offset}', "
+            f"schedule_interval => INTERVAL '{schedule}')"
+        )
+
+    # The policies only cover recent data, materialise the existing history once.
+    # Refreshing cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        for name in AGGREGATES:
+            op.execute(f"CALL refresh_continuous_aggregate('{name}', NULL, NULL)")
+
+
+def downgrade() -> None:
+    # Drop the aggregates built on top of others first
+    for name in reversed(list(AGGREGATES)):
+        op.execute(f"DROP MATERIALIZED VIEW IF EXISTS {name}")
@@ -0,0 +1,119 @@
+"""Convert status to a TimescaleDB hypertable
+
+Revision ID: 88188d70371d
+Revises: a9c3afd93c96
+Create Date: 2026-10-17 09:12:41.302115
+
+"""
+from datetime import timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from config import STATUS_COMPRESS_AFTER_DAYS, STATUS_RETENTION_DAYS
+
+
+# revision identifiers, used by Alembic.
+revision: str = '88188d70371d'
+down_revision: Union[str, None] = 'a9c3afd93c96'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Rows are copied one time window per transaction, so the live table is never locked for the whole copy
+BACKFILL_WINDOW = timedelta(hours=1)
+
+COLUMNS = "unit_id, time, power, current, voltage, toggle, power_factor, frequency, total_energy"
+
+
+def backfill(source: str, target: str, where: str = "TRUE") -> None:
+    connection = op.get_bind()
+    start, end = connection.execute(sa.text(f"SELECT min(time), max(time) FROM {source}")).first()
+    if start is None:
+        return
+    with op.get_context().autocommit_block():
+        while start <= end:
+            connection.execute(
+                sa.text(
+                    f"INSERT INTO {target} ({COLUMNS}) "
+                    f"SELECT {COLUMNS} FROM {source} "
+                    f"WHERE {where} AND time >= :start AND time < :end "
+                    "ON CONFLICT DO NOTHING"
+                ),
+                {"start": start, "end": start + BACKFILL_WINDOW}
+            )
+            start += BACKFILL_WINDOW
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS timescaledb")
+    op.create_table('status_new',
+    sa.Column('unit_id', sa.Integer(), nullable=False),
+    sa.Column('time', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('power', sa.Float(), nullable=True),
+    sa.Column('current', sa.Float(), nullable=True),
+    sa.Column('voltage', sa.Float(), nullable=True),
+    sa.Column('toggle', sa.Boolean(), nullable=True),
+    sa.Column('power_factor', sa.Float(), nullable=True),
+    sa.Column('frequency', sa.Float(), nullable=True),
+    sa.Column('total_energy', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['unit_id'], ['units.id'], ),
+    sa.PrimaryKeyConstraint('unit_id', 'time', name='status_unit_id_time_pkey')
+    )
+    op.execute("SELECT create_hypertable('status_new', 'time', chunk_time_interval => INTERVAL '1 day')")
+    op.create_index('ix_status_unit_id_time', 'status_new', ['unit_id', sa.text('time DESC')], unique=False)
+
+    # Copy the existing readings in batches while the old table keeps receiving writes.
+    # Readings without a unit cannot be keyed and are dropped.
+    backfill('status', 'status_new', where="unit_id IS NOT NULL")
+
+    # Block writes, copy what arrived during the backfill and swap the tables
+    op.execute("LOCK TABLE status IN EXCLUSIVE MODE")
+    op.execute(
+        f"INSERT INTO status_new ({COLUMNS}) "
+        f"SELECT {COLUMNS} FROM status "
+        "WHERE unit_id IS NOT NULL AND time >= (SELECT coalesce(max(time), '-infinity') FROM status_new) "
+        "ON CONFLICT DO NOTHING"
+    )
+    op.drop_table('status')
+    op.rename_table('status_new', 'status')
+
+    # Compress old chunks, one segment per unit so per-unit queries only decompress their own rows
+    op.execute(
+        "ALTER TABLE status SET ("
+        "timescaledb.compress, "
+        "timescaledb.compress_segmentby = 'unit_id', "
+        "timescaledb.compress_orderby = 'time DESC')"
+    )
+    op.execute(f"SELECT add_compression_policy('status', INTERVAL '{STATUS_COMPRESS_AFTER_DAYS} days')")
+    if STATUS_RETENTION_DAYS > 0:
+        op.execute(f"SELECT add_retention_policy('status', INTERVAL '{STATUS_RETENTION_DAYS} days')")
+
+
+def downgrade() -> None:
+    op.create_table('status_plain',
+    sa.Column('time', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('power', sa.Float(), nullable=True),
+    sa.Column('current', sa.Float(), nullable=True),
+    sa.Column('voltage', sa.Float(), nullable=True),
+    sa.Column('toggle', sa.Boolean(), nullable=True),
+    sa.Column('power_factor', sa.Float(), nullable=True),
+    sa.Column('frequency', sa.Float(), nullable=True),
+    sa.Column('total_energy', sa.Float(), nullable=True),
+    sa.Column('unit_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['unit_id'], ['units.id'], ),
+    sa.PrimaryKeyConstraint('time', name='status_plain_pkey')
+    )
+    # The old key is time only, readings of different units at the same time keep the first one
+    backfill('status', 'status_plain')
+    op.execute("LOCK TABLE status IN EXCLUSIVE MODE")
+    op.execute(
+        f"INSERT INTO status_plain ({COLUMNS}) "
+        f"SELECT {COLUMNS} FROM status "
+        "WHERE time >= (SELECT coalesce(max(time), '-infinity') FROM status_plain) "
+        "ON CONFLICT DO NOTHING"
+    )
+    # Dropping the hypertable also removes its compression and retention policies
+    op.drop_table('status')
+    op.rename_table('status_plain', 'status')
+    op.execute("ALTER INDEX status_plain_pkey RENAME TO status_pkey")
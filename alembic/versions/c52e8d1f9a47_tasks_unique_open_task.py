@@ -0,0 +1,40 @@
+"""Allow one open task per device and type
+
+Revision ID: c52e8d1f9a47
+Revises: 7a60d4411055
+Create Date: 2026-10-17 11:41:08.927344
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52e8d1f9a47'
+down_revision: Union[str, None] = '7a60d4411055'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Duplicates left by concurrent add_task calls: keep the oldest open task, close the others
+    op.execute(
+        """
+        UPDATE tasks SET status = 'COMPLETED'
+        WHERE status != 'COMPLETED' AND id NOT IN (
+            SELECT DISTINCT ON (device_id, type_id) id FROM tasks
+            WHERE status != 'COMPLETED'
+            ORDER BY device_id, type_id, time, id
+        )
+        """
+    )
+    op.create_index(
+        'ix_tasks_open_device_type', 'tasks', ['device_id', 'type_id'], unique=True,
+        postgresql_where=sa.text("status != 'COMPLETED'")
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tasks_open_device_type', table_name='tasks')
@@ -0,0 +1,27 @@
+"""Index tasks on (time, id) for keyset pagination
+
+Revision ID: e4b7a3c09d12
+Revises: c52e8d1f9a47
+Create Date: 2026-10-17 12:26:53.140672
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b7a3c09d12'
+down_revision: Union[str, None] = 'c52e8d1f9a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The task board pages newest first, the audit log is already served by its timestamp primary key
+    op.create_index('ix_tasks_time_id', 'tasks', [sa.text('time DESC'), sa.text('id DESC')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tasks_time_id', table_name='tasks')
@@ -1,7 +1,14 @@
 from fastapi import FastAPI
+from config import MQTT_INGEST_ENABLED
+from ingest import start_ingest, stop_ingest
 from mqtt_client import client
 from routers import api_router
-from database.setup import *
+from device_registry import device_registry
+from rbac import rbac
+from auth import principal_cache
+from audit_writer import audit_writer
+from task_summary import task_summary_reconciler
+from fanout import fanout_subscriber
 
 def create_app() -> FastAPI:
     app = FastAPI(
@@ -9,15 +16,36 @@ def create_app() -> FastAPI:
         description="A SCADA system for controlling traffic lights",
         version="0.1.0"
     )
-
-    # Join the current working directory with the file path
-    create_default_permissions()
-    create_default_roles()
-    create_default_admin()
-    create_side_roles()
-    populate_task_types()
-    
-    client.connect()
-    client.loop_start()
     app.include_router(api_router)
+
+    @app.on_event("startup")
+    async def startup():
+        device_registry.load()
+        device_registry.listen()
+        rbac.load()
+        rbac.listen()
+        principal_cache.listen()
+        audit_writer.start()
+        task_summary_reconciler.start()
+        # The fan-out subscriber runs on the application's event loop
+        await fanout_subscriber.start()
+        if MQTT_INGEST_ENABLED:
+            await start_ingest()
+        else:
+            # Only needed to publish commands to the units
+            client.connect()
+            client.loop_start()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        if MQTT_INGEST_ENABLED:
+            await stop_ingest()
+        else:
+            client.disconnect()
+            client.loop_stop()
+        await fanout_subscriber.stop()
+        task_summary_reconciler.stop()
+        # Flush the audit events still queued
+        audit_writer.stop()
+
     return app
\ No newline at end of file
@@ -0,0 +1,140 @@
+# audit_writer.py
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from database import engine, insert_batch
+from models.Audit import ActionEnum, Audit
+from config import AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_QUEUE_SIZE, AUDIT_RETRY_MAX_INTERVAL
+
+class AuditWriter:
+    """
+    Write-behind writer for audit events.
+
+    `write` only queues the event, a background thread bulk-inserts the queue
+    in batches of up to `batch_size` rows every `flush_interval` seconds, so
+    audited endpoints do not pay for an extra commit. The queue holds at most
+    `maxsize` events: when it is full the oldest event is dropped and counted.
+    A batch that fails on a connection error is kept and retried with an
+    exponential backoff, one rejected by the database is retried row by row so
+    only the bad rows are lost. `stop` flushes what is left.
+    """
+    def __init__(self, batch_size: int = AUDIT_BATCH_SIZE, flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 maxsize: int = AUDIT_QUEUE_SIZE, retry_max_interval: float = AUDIT_RETRY_MAX_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_max_interval = retry_max_interval
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        # The batch being written, only touched by the writer thread
+        self._pending: list[dict] = []
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._clock_lock = threading.Lock()
+        self._last_timestamp = datetime.min
+        self._stats = {
+            "queued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "retries": 0,
+            "flushes": 0,
+            "max_flush_ms": 0.0,
+        }
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        # Events queued after the writer stopped
+        if not self._flush():
+            print(f"Audit writer stopped with {len(self._pending) + self._queue.qsize()} events unwritten")
+
+    def write(self, email: str, action: ActionEnum, details: str):
+        row = {"timestamp": self._timestamp(), "email": email, "action": action, "details": details}
+        while True:
+            try:
+                self._queue.put_nowait(row)
+                self._stats["queued"] += 1
+                return
+            except queue.Full:
+                # Never block the request on the database, make room by dropping the oldest event
+                try:
+                    self._queue.get_nowait()
+                    self._stats["dropped"] += 1
+                except queue.Empty:
+                    pass
+
+    def stats(self) -> dict:
+        return dict(self._stats, depth=self._queue.qsize(), pending=len(self._pending))
+
+    def _timestamp(self) -> datetime:
+        # The timestamp is the primary key of the audit table, keep it unique within the process.
+        # Collisions with other processes are resolved by _insert.
+        with self._clock_lock:
+            timestamp = max(datetime.utcnow(), self._last_timestamp + timedelta(microseconds=1))
+            self._last_timestamp = timestamp
+        return timestamp
+
+    def _run(self):
+        interval = self.flush_interval
+        while not self._stopping.wait(interval):
+            if self._flush():
+                interval = self.flush_interval
+            else:
+                self._stats["retries"] += 1
+                interval = min(interval * 2, self.retry_max_interval)
+
+    def _flush(self) -> bool:
+        # False when the database is unreachable, the pending batch is then kept for the next flush
+        while self._pending or not self._queue.empty():
+            while len(self._pending) < self.batch_size:
+                try:
+                    self._pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            try:
+                self._write_pending()
+            except (OperationalError, InterfaceError) as e:
+                print(f"Error writing {len(self._pending)} audit events, retrying: {e}")
+                return False
+            except Exception as e:
+                self._stats["failed"] += len(self._pending)
+                print(f"Dropping {len(self._pending)} audit events: {e}")
+                self._pending = []
+            elapsed = (time.perf_counter() - started) * 1000
+            self._stats["flushes"] += 1
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed)
+        return True
+
+    def _write_pending(self):
+        count = len(self._pending)
+        failed = insert_batch(self._insert, self._pending, lambda row: f"audit event of {row['email']}")
+        self._stats["written"] += count - failed
+        self._stats["failed"] += failed
+
+    def _insert(self, rows: list[dict]):
+        # Rows whose timestamp was taken by another process are skipped by the database,
+        # and inserted again a microsecond later until every row is written
+        with engine.begin() as connection:
+            while rows:
+                inserted = set(connection.execute(
+                    insert(Audit).on_conflict_do_nothing(index_elements=[Audit.timestamp]).returning(Audit.timestamp),
+                    rows
+                ).scalars())
+                rows = [
+                    dict(row, timestamp=row["timestamp"] + timedelta(microseconds=1))
+                    for row in rows if row["timestamp"] not in inserted
+                ]
+
+audit_writer = AuditWriter()
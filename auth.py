@@ -1,20 +1,33 @@
 # auth.py
 
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 
+import redis
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from models.Account import Account, Role
+from models.Account import Account
 from utils import verify_password
 from database import SessionLocal
-from config import SECRET_KEY, ALGORITHM, PermissionEnum
+from rbac import rbac
+from redis_client import client as redis_client
+from redis_listener import RedisListener
+from config import SECRET_KEY, ALGORITHM, AUTH_CACHE_TTL, PASSWORD_QUEUE_SIZE, PASSWORD_WORKERS, PermissionEnum
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
+# Users modified through user_router are announced here so every API worker drops their cached tokens
+AUTH_USER_CHANNEL = "auth:user"
+
 def get_db():
     db = SessionLocal()
     try:
@@ -22,9 +35,73 @@ def get_db():
     finally:
         db.close()
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(Account).filter(Account.username == username).first()
-    if user and verify_password(password, user.password):
+class PasswordVerifier:
+    """
+    Verifies passwords in a bounded thread pool, off the event loop.
+
+    bcrypt costs hundreds of milliseconds of CPU per call and releases the GIL
+    while hashing, so at most `workers` verifications run at once in their own
+    threads. Up to `max_waiting` more logins wait for a slot, beyond that the
+    login is answered with 503 instead of queueing without bound.
+    """
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_waiting: int = PASSWORD_QUEUE_SIZE):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(workers)
+        self._waiting = 0
+        self._in_flight = 0
+        self._stats = {
+            "verified": 0,
+            "rejected": 0,
+            "max_waiting": 0,
+            "last_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "last_verify_ms": 0.0,
+            "max_verify_ms": 0.0,
+        }
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        if self._waiting >= self.max_waiting:
+            self._stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many logins in progress, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+        queued = time.perf_counter()
+        self._waiting += 1
+        self._stats["max_waiting"] = max(self._stats["max_waiting"], self._waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        try:
+            started = time.perf_counter()
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, verify_password, plain_password, hashed_password
+            )
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+        finished = time.perf_counter()
+        wait, elapsed = (started - queued) * 1000, (finished - started) * 1000
+        self._stats["verified"] += 1
+        self._stats["last_wait_ms"] = wait
+        self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait)
+        self._stats["last_verify_ms"] = elapsed
+        self._stats["max_verify_ms"] = max(self._stats["max_verify_ms"], elapsed)
+        return result
+
+    def stats(self) -> dict:
+        return dict(self._stats, workers=self.workers, in_flight=self._in_flight, waiting=self._waiting)
+
+password_verifier = PasswordVerifier()
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await db.scalar(select(Account).where(Account.username == username))
+    if user and await password_verifier.verify(password, user.password):
         return user
     return None
 
@@ -34,47 +111,139 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Account:
+class Principal:
+    """
+    The identity of a verified token, detached from any session.
+
+    Its role's name and permissions come from the RBAC snapshot, so role
+    changes apply without waiting for the cached token to expire.
+    """
+    def __init__(self, user_id: int, email: str, username: str, role: int):
+        self.user_id = user_id
+        self.email = email
+        self.username = username
+        self.role = role
+
+    @classmethod
+    def from_account(cls, user: Account) -> "Principal":
+        return cls(
+            user_id=user.user_id,
+            email=user.email,
+            username=user.username,
+            role=user.role
+        )
+
+    def account(self) -> Account:
+        # Transient account, not attached to a session: reload it to modify the user
+        return Account(user_id=self.user_id, email=self.email, username=self.username, role=self.role)
+
+    @property
+    def role_name(self) -> str | None:
+        return rbac.role_name(self.role)
+
+    def has_any(self, required: list[PermissionEnum]) -> bool:
+        return rbac.has_any(self.role, required)
+
+class PrincipalCache:
+    """
+    Verified token -> Principal, kept for `ttl` seconds at most and never past the token expiry.
+
+    Authorisation of a cached token costs no database round-trip. Entries of
+    a user are dropped when user_router modifies it, and the change is
+    announced on Redis so the other API workers drop theirs. The cache is
+    cleared when the subscription is re-established after a Redis error.
+    """
+    def __init__(self, ttl: int = AUTH_CACHE_TTL, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: dict[str, tuple[float, Principal]] = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def listen(self):
+        # Drop users modified by other workers, on a background thread
+        if self._listener:
+            return
+        self._listener = RedisListener("auth-cache", {AUTH_USER_CHANNEL: self._on_user}, on_reconnect=self.clear)
+        self._listener.start()
+
+    def get(self, token: str) -> Principal | None:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires, principal = entry
+        if expires < time.time():
+            with self._lock:
+                self._entries.pop(token, None)
+            return None
+        return principal
+
+    def put(self, token: str, principal: Principal, token_expires: float | None):
+        expires = time.time() + self.ttl
+        if token_expires:
+            expires = min(expires, token_expires)
+        with self._lock:
+            if len(self._entries) >= self.maxsize:
+                now = time.time()
+                self._entries = {key: entry for key, entry in self._entries.items() if entry[0] >= now}
+                if len(self._entries) >= self.maxsize:
+                    self._entries.clear()
+            self._entries[token] = (expires, principal)
+
+    def invalidate_user(self, user_id: int, announce: bool = True):
+        with self._lock:
+            self._entries = {key: entry for key, entry in self._entries.items() if entry[1].user_id != user_id}
+        if announce:
+            try:
+                redis_client.publish(AUTH_USER_CHANNEL, user_id)
+            except redis.RedisError as e:
+                print(f"Error announcing user {user_id}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def _on_user(self, message):
+        self.invalidate_user(int(message["data"]), announce=False)
+
+principal_cache = PrincipalCache()
+
+def load_principal(token: str, db: Session) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        user = db.query(Account).filter(Account.username == username).first()
-        if user is None:
-            raise credentials_exception
-        return user
     except JWTError:
         raise credentials_exception
+    username: str = payload.get("sub")
+    if username is None:
+        raise credentials_exception
+    user = db.query(Account).filter(Account.username == username).first()
+    if user is None:
+        raise credentials_exception
+    principal = Principal.from_account(user)
+    principal_cache.put(token, principal, payload.get("exp"))
+    return principal
+
+def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    # A plain function, FastAPI runs it in the threadpool since a cache miss queries the database
+    return load_principal(token, db)
+
+async def get_current_user(principal: Principal = Depends(get_current_principal)) -> Account:
+    return principal.account()
     
 def ws_get_current_user(token: str, db: Session, required_permission: list[PermissionEnum]) -> Account:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        user = db.query(Account).filter(Account.username == username).first()
-        if user is None:
-            raise credentials_exception
-        u_permissions = db.query(Role).filter(Role.role_id == user.role).first().permissions
-        u_p_names = set([permission.permission_name for permission in u_permissions])
-        # If the current user has none of the required permissions
-        required_names = set([p.value for p in required_permission])
-        if not required_names.intersection(u_p_names):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You do not have the required permissions to access this resource."
-            )
-        return user
-    except JWTError:
-        raise credentials_exception
\ No newline at end of file
+    principal = load_principal(token, db)
+    # If the current user has none of the required permissions
+    if not principal.has_any(required_permission):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have the required permissions to access this resource."
+        )
+    return principal.account()
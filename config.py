@@ -18,6 +18,8 @@ SUPERADMIN_EMAIL = config("SUPERADMIN_EMAIL")
 SECRET_KEY = config("SECRET_KEY")  # Replace with a secure key
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 1 day in minutes
+AUTH_CACHE_TTL = config("AUTH_CACHE_TTL", default=60, cast=int) # seconds a verified token is trusted without the database
+RBAC_VERSION_CHECK_INTERVAL = config("RBAC_VERSION_CHECK_INTERVAL", default=30, cast=int) # seconds between checks of the role version in Redis
 POWERLOST_THRESHOLD = 50 # 50W
 DEBUG = config("DEBUG", default=False, cast=bool)
 
@@ -32,4 +34,49 @@ class PermissionEnum(Enum):
 # MQTT setup
 MQTT_BROKER = config("MQTT_BROKER")
 MQTT_PORT = int(config("MQTT_PORT"))
-MQTT_CLIENT_ID = config("MQTT_CLIENT_ID")
\ No newline at end of file
+MQTT_CLIENT_ID = config("MQTT_CLIENT_ID")
+# Run MQTT ingest inside the API process, disable when running ingest.py separately
+MQTT_INGEST_ENABLED = config("MQTT_INGEST_ENABLED", default=True, cast=bool)
+# Shared subscription group of the ingest instances ($share/<group>/unit/+/status), empty subscribes plainly
+MQTT_SHARED_GROUP = config("MQTT_SHARED_GROUP", default="")
+
+# Status ingest
+STATUS_BATCH_SIZE = config("STATUS_BATCH_SIZE", default=2000, cast=int)
+STATUS_FLUSH_INTERVAL = config("STATUS_FLUSH_INTERVAL", default=0.25, cast=float) # seconds
+# Redis stream buffering statuses between MQTT receive and database writes
+STATUS_STREAM_MAXLEN = config("STATUS_STREAM_MAXLEN", default=1000000, cast=int)
+STATUS_STREAM_MAX_AGE = config("STATUS_STREAM_MAX_AGE", default=0, cast=int) # seconds, replaces the length cap when set
+STATUS_STREAM_CLAIM_IDLE = config("STATUS_STREAM_CLAIM_IDLE", default=60, cast=int) # seconds before pending entries are reclaimed
+STATUS_WRITER_CONSUMERS = config("STATUS_WRITER_CONSUMERS", default=1, cast=int) # 0 when writers run separately
+STATUS_RETRY_MAX_INTERVAL = config("STATUS_RETRY_MAX_INTERVAL", default=30.0, cast=float) # seconds, longest backoff while the database is unreachable
+INGEST_SHARDS = config("INGEST_SHARDS", default=4, cast=int)
+INGEST_QUEUE_SIZE = config("INGEST_QUEUE_SIZE", default=10000, cast=int)
+
+# Energy charts, closed ranges are cached in Redis and by browsers for this long
+ENERGY_CACHE_TTL = config("ENERGY_CACHE_TTL", default=3600, cast=int) # seconds
+
+# TimescaleDB policies for the status hypertable, applied by migrations
+STATUS_COMPRESS_AFTER_DAYS = config("STATUS_COMPRESS_AFTER_DAYS", default=7, cast=int)
+STATUS_RETENTION_DAYS = config("STATUS_RETENTION_DAYS", default=0, cast=int) # 0 keeps all data
+
+# WebSocket fan-out
+WS_QUEUE_SIZE = config("WS_QUEUE_SIZE", default=100, cast=int) # messages queued per connection
+WS_SEND_TIMEOUT = config("WS_SEND_TIMEOUT", default=5.0, cast=float) # seconds
+
+# Live device state in Redis
+DEVICE_STATE_TTL = config("DEVICE_STATE_TTL", default=300, cast=int) # seconds without messages before a unit counts as disconnected
+
+# Password verification, bcrypt runs off the event loop
+PASSWORD_WORKERS = config("PASSWORD_WORKERS", default=2, cast=int) # concurrent bcrypt verifications
+PASSWORD_QUEUE_SIZE = config("PASSWORD_QUEUE_SIZE", default=50, cast=int) # logins waiting before 503
+
+# Open task index, see task_index.py
+OPEN_TASK_TTL = config("OPEN_TASK_TTL", default=300, cast=int) # seconds an open task is trusted without the database
+TASK_SUMMARY_RECONCILE_INTERVAL = config("TASK_SUMMARY_RECONCILE_INTERVAL", default=300, cast=int) # seconds between recounts of the task counters
+
+# Audit log, written behind the requests by audit_writer.py
+AUDIT_BATCH_SIZE = config("AUDIT_BATCH_SIZE", default=500, cast=int)
+AUDIT_FLUSH_INTERVAL = config("AUDIT_FLUSH_INTERVAL", default=1.0, cast=float) # seconds
+AUDIT_QUEUE_SIZE = config("AUDIT_QUEUE_SIZE", default=10000, cast=int) # events buffered before the oldest are dropped
+AUDIT_RETRY_MAX_INTERVAL = config("AUDIT_RETRY_MAX_INTERVAL", default=30.0, cast=float) # seconds, longest backoff while the database is unreachable
+AUDIT_EXPORT_CHUNK = config("AUDIT_EXPORT_CHUNK", default=5000, cast=int) # rows fetched per round-trip by the CSV export
\ No newline at end of file
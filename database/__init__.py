@@ -1,7 +1,11 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker 
 from sqlalchemy.ext.declarative import declarative_base
 from config import URL_DATABASE
+from typing import Callable
 import psycopg2
 
 # Import all the models in the database
@@ -16,8 +20,38 @@ engine = create_engine(URL_DATABASE, connect_args=connect_args)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# asyncpg engine for the endpoints running on the event loop, so their queries do not block it
+async_engine = create_async_engine(make_url(URL_DATABASE).set(drivername="postgresql+asyncpg"), pool_pre_ping=True)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+def insert_batch(insert: Callable[[list[dict]], None], rows: list[dict], describe: Callable[[dict], str]) -> int:
+    """
+    Inserts `rows` in one call of `insert`, or one row at a time when the database rejects the batch.
+
+    A bad row fails the whole batch, so the rows are then written one by one
+    and the bad ones dropped, logged with `describe`. Returns the number of
+    dropped rows. Rows leave `rows` once handled and other errors are raised,
+    so after a lost connection the caller can retry `rows` where it stopped.
+    """
+    try:
+        insert(rows)
+        rows.clear()
+        return 0
+    except (IntegrityError, DataError):
+        pass
+    dropped = 0
+    while rows:
+        try:
+            insert(rows[:1])
+        except (IntegrityError, DataError) as e:
+            print(f"Dropping {describe(rows[0])}: {e}")
+            dropped += 1
+        rows.pop(0)
+    return dropped
+
 def execute_sql_file(file_path: str):
     try:
         connection = psycopg2.connect(URL_DATABASE)
@@ -1,4 +1,4 @@
-from database import SessionLocal
+from database import AsyncSessionLocal, SessionLocal
 from sqlalchemy.orm import Session
 from .__init__ import engine
 
@@ -9,4 +9,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -144,3 +144,14 @@ def populate_task_types():
             session.commit()
             print(f"Added task type {task_type.name} to the database.")
     print("Task types populated successfully.")
+
+def seed():
+    # Run once per deployment, before starting the API and ingest processes
+    create_default_permissions()
+    create_default_roles()
+    create_default_admin()
+    create_side_roles()
+    populate_task_types()
+
+if __name__ == "__main__":
+    seed()
\ No newline at end of file
@@ -0,0 +1,152 @@
+# device_registry.py
+import threading
+import time
+import uuid
+import redis
+from database import SessionLocal
+from models.unit import Unit
+from redis_client import client as redis_client
+from redis_listener import RedisListener
+
+# Unit changes are announced here so the API and ingest processes refresh their registries
+REGISTRY_CHANNEL = "registry:unit"
+
+class Device:
+    """
+    Cached view of a unit, enough to route MQTT messages and commands.
+    """
+    def __init__(self, id: int, mac: str, name: str, cluster_id: int | None, on_time, off_time):
+        self.id = id
+        self.mac = mac
+        self.name = name
+        self.cluster_id = cluster_id
+        self.on_time = on_time
+        self.off_time = off_time
+
+    @classmethod
+    def from_unit(cls, unit) -> "Device":
+        return cls(
+            id=unit.id,
+            mac=unit.mac,
+            name=unit.name,
+            cluster_id=unit.cluster_id,
+            on_time=unit.on_time,
+            off_time=unit.off_time
+        )
+
+class DeviceRegistry:
+    """
+    Process-local registry of units keyed by MAC address and by id.
+
+    The registry is loaded once at startup and kept up to date by the routers
+    that create, update or delete units. Every change is announced on Redis so
+    the registries of the other processes refresh the unit from the database.
+    Lookups that miss fall back to the database, and unknown MAC addresses are
+    remembered for `miss_ttl` seconds so a misconfigured device does not hit
+    the database on every message. Announcements missed while the subscription
+    was down are caught up with a full reload.
+    """
+    def __init__(self, miss_ttl: int = 60):
+        self.miss_ttl = miss_ttl
+        self._by_mac: dict[str, Device] = {}
+        self._by_id: dict[int, Device] = {}
+        self._missing: dict[str, float] = {}
+        self._lock = threading.Lock()
+        # Identifies this process, its own announcements are ignored
+        self._origin = uuid.uuid4().hex
+        self._listener = None
+
+    def load(self):
+        with SessionLocal() as session:
+            units = session.query(
+                Unit.id, Unit.mac, Unit.name, Unit.cluster_id, Unit.on_time, Unit.off_time
+            ).all()
+        devices = [Device.from_unit(unit) for unit in units]
+        with self._lock:
+            self._by_mac = {device.mac: device for device in devices}
+            self._by_id = {device.id: device for device in devices}
+            self._missing = {}
+        print(f"Loaded {len(devices)} devices into the registry")
+
+    def listen(self):
+        # Refresh units changed by other processes, on a background thread
+        if self._listener:
+            return
+        self._listener = RedisListener(
+            "device-registry", {REGISTRY_CHANNEL: self._on_announcement}, on_reconnect=self.load
+        )
+        self._listener.start()
+
+    def get_by_mac(self, mac: str) -> Device | None:
+        device = self._by_mac.get(mac)
+        if device is not None:
+            return device
+        if self._missing.get(mac, 0) > time.monotonic():
+            return None
+        device = self._fetch(Unit.mac == mac)
+        if device is None:
+            self._missing[mac] = time.monotonic() + self.miss_ttl
+        return device
+
+    def get_by_id(self, unit_id: int) -> Device | None:
+        device = self._by_id.get(unit_id)
+        if device is not None:
+            return device
+        return self._fetch(Unit.id == unit_id)
+
+    def get_by_cluster(self, cluster_id: int) -> list[Device]:
+        return [device for device in list(self._by_id.values()) if device.cluster_id == cluster_id]
+
+    def get_all(self) -> list[Device]:
+        return list(self._by_id.values())
+
+    def put(self, unit):
+        self._store(Device.from_unit(unit))
+        self._announce(unit.id)
+
+    def _store(self, device: Device):
+        with self._lock:
+            previous = self._by_id.get(device.id)
+            if previous and previous.mac != device.mac:
+                self._by_mac.pop(previous.mac, None)
+            self._by_id[device.id] = device
+            self._by_mac[device.mac] = device
+            self._missing.pop(device.mac, None)
+
+    def refresh(self, unit_id: int, announce: bool = True) -> Device | None:
+        device = self._fetch(Unit.id == unit_id)
+        if device is None:
+            self.remove(unit_id, announce=False)
+        if announce:
+            self._announce(unit_id)
+        return device
+
+    def remove(self, unit_id: int, announce: bool = True):
+        with self._lock:
+            device = self._by_id.pop(unit_id, None)
+            if device:
+                self._by_mac.pop(device.mac, None)
+        if announce:
+            self._announce(unit_id)
+
+    def _announce(self, unit_id: int):
+        try:
+            redis_client.publish(REGISTRY_CHANNEL, f"{self._origin}:{unit_id}")
+        except redis.RedisError as e:
+            print(f"Error announcing unit {unit_id}: {e}")
+
+    def _on_announcement(self, message):
+        origin, unit_id = message["data"].decode().split(":")
+        if origin != self._origin:
+            self.refresh(int(unit_id), announce=False)
+
+    def _fetch(self, criterion) -> Device | None:
+        with SessionLocal() as session:
+            unit = session.query(Unit).filter(criterion).first()
+            if unit is None:
+                return None
+            device = Device.from_unit(unit)
+        self._store(device)
+        return device
+
+device_registry = DeviceRegistry()
@@ -0,0 +1,91 @@
+# device_state.py
+import json
+from datetime import datetime
+import pytz
+from redis.client import Pipeline
+from redis_client import client as redis_client
+from config import DEVICE_STATE_TTL
+from utils import get_tz_datetime
+
+def state_key(unit_id) -> str:
+    return f"device_state:{unit_id}"
+
+def pack_schedule(body: dict) -> str:
+    # hour_on:minute_on-hour_off:minute_off, compared as a whole to detect schedule changes
+    return f"{body.get('hour_on')}:{body.get('minute_on')}-{body.get('hour_off')}:{body.get('minute_off')}"
+
+def write_status(unit_id: int, body: dict, message: str, pipe: Pipeline | None = None) -> str | None:
+    """
+    Stores the telemetry of a unit and returns its previous packed schedule.
+
+    The state is a Redis hash with separate fields for the telemetry message as
+    sent to WebSocket clients, the power and toggle read by fleet views, the
+    liveness, the last-seen timestamp and the schedule. Commands already queued
+    on `pipe`, such as the fan-out publish, share the same round-trip.
+    """
+    pipe = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    key = state_key(unit_id)
+    index = len(pipe)
+    pipe.hget(key, "schedule")
+    pipe.hset(key, mapping={
+        "telemetry": message,
+        "power": body["power"],
+        # Devices may send a JSON boolean, which HSET does not accept
+        "toggle": int(body["toggle"]),
+        "alive": 1,
+        "seen": body["time"],
+        "schedule": pack_schedule(body),
+    })
+    pipe.expire(key, DEVICE_STATE_TTL)
+    previous = pipe.execute()[index]
+    return previous.decode() if previous else None
+
+def write_liveness(unit_id: int, alive: bool, seen: datetime, pipe: Pipeline | None = None):
+    # The telemetry is kept, so it is still available once the unit reconnects
+    pipe = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    key = state_key(unit_id)
+    pipe.hset(key, mapping={"alive": int(alive), "seen": seen.timestamp()})
+    pipe.expire(key, DEVICE_STATE_TTL)
+    pipe.execute()
+
+def _read(unit_ids: list, fields: list[str]) -> list[list]:
+    # One HMGET per unit, all in a single round-trip
+    pipe = redis_client.pipeline(transaction=False)
+    for unit_id in unit_ids:
+        pipe.hmget(state_key(unit_id), fields)
+    return pipe.execute() if unit_ids else []
+
+def disconnected_message(seen: float | None = None) -> str:
+    time = datetime.fromtimestamp(seen, pytz.UTC) if seen else get_tz_datetime()
+    return json.dumps({"alive": "0", "time": time.isoformat()})
+
+def read_messages(unit_ids: list) -> list[str]:
+    """
+    The last message of each unit in the shape of /ws/unit/:unitId/status.
+
+    Live units get their last telemetry as stored, without parsing it. Units
+    that reported a disconnection, or whose state expired, get an alive "0"
+    message.
+    """
+    messages = []
+    for telemetry, alive, seen in _read(unit_ids, ["telemetry", "alive", "seen"]):
+        if telemetry and alive != b"0":
+            messages.append(telemetry.decode())
+        else:
+            messages.append(disconnected_message(float(seen) if seen else None))
+    return messages
+
+def read_states(unit_ids: list) -> list[dict | None]:
+    # Power, toggle, liveness and last-seen of each unit, None when its state expired
+    states = []
+    for power, toggle, alive, seen in _read(unit_ids, ["power", "toggle", "alive", "seen"]):
+        if seen is None:
+            states.append(None)
+            continue
+        states.append({
+            "power": float(power) if power is not None else None,
+            "toggle": int(toggle) if toggle is not None else None,
+            "alive": alive == b"1",
+            "last_seen": datetime.fromtimestamp(float(seen), pytz.UTC),
+        })
+    return states
@@ -0,0 +1,67 @@
+# fanout.py
+import asyncio
+import json
+import redis.asyncio as aioredis
+from redis.client import Pipeline
+from config import REDIS_HOST, REDIS_PORT
+from redis_client import client as redis_client
+from websocket_manager import manager, notification_manager, Notification, NOTI_TYPE
+
+UNIT_CHANNEL = "ws:unit"
+NOTIFICATION_CHANNEL = "ws:notification"
+
+def publish_status(unit_id: int, message: str, pipe: Pipeline | None = None):
+    # Called by whichever process ingested the message, every API worker delivers it.
+    # With a pipeline the publish is only queued, to share the round-trip of the state write.
+    (pipe if pipe is not None else redis_client).publish(UNIT_CHANNEL, json.dumps({"unit_id": unit_id, "message": message}))
+
+def publish_notification(notification: Notification):
+    redis_client.publish(NOTIFICATION_CHANNEL, json.dumps(notification.to_json()))
+
+class FanoutSubscriber:
+    """
+    Delivers messages published on the fan-out channels to this process's own WebSockets.
+
+    Each API worker runs one subscriber on its event loop. The subscription is
+    re-established after a Redis error, messages published meanwhile are lost
+    as with any pub/sub delivery.
+    """
+    def __init__(self, retry_interval: float = 1.0):
+        self.retry_interval = retry_interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            client = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(UNIT_CHANNEL, NOTIFICATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        await self._dispatch(message["channel"].decode(), json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Fan-out subscription failed: {e}")
+                await asyncio.sleep(self.retry_interval)
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+
+    async def _dispatch(self, channel: str, payload: dict):
+        if channel == UNIT_CHANNEL:
+            await manager.send_private_message(payload["message"], payload["unit_id"])
+        elif channel == NOTIFICATION_CHANNEL:
+            notification = Notification(message=payload["message"], type=NOTI_TYPE(payload["type"]))
+            await notification_manager.send_notification(notification)
+
+fanout_subscriber = FanoutSubscriber()
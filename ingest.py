@@ -0,0 +1,48 @@
+# ingest.py
+"""
+Headless ingest service: receives MQTT telemetry, persists statuses and
+publishes live updates to Redis for the API workers to deliver.
+
+Run with `python ingest.py` and set MQTT_INGEST_ENABLED=false for the API
+processes, so they only serve HTTP and WebSockets.
+"""
+import asyncio
+import signal
+from device_registry import device_registry
+from mqtt_client import client
+from status_writer import status_writer
+from task_index import open_tasks
+
+async def start_ingest():
+    # The pipeline workers run on the calling event loop
+    open_tasks.load()
+    open_tasks.listen()
+    status_writer.start()
+    await client.pipeline.start()
+    client.ingest = True
+    client.connect()
+    client.loop_start()
+
+async def stop_ingest():
+    # Stop receiving before draining the pipeline and flushing the remaining statuses
+    client.disconnect()
+    client.loop_stop()
+    await client.pipeline.stop()
+    status_writer.stop()
+
+async def main():
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    device_registry.load()
+    device_registry.listen()
+    await start_ingest()
+    print("Ingest service started")
+    await stopping.wait()
+    print("Ingest service stopping...")
+    await stop_ingest()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+# ingest_pipeline.py
+import asyncio
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from config import INGEST_SHARDS, INGEST_QUEUE_SIZE
+
+class Shard:
+    """
+    A bounded queue drained by a single worker, so its messages are handled in order.
+    """
+    def __init__(self, index: int, maxsize: int):
+        self.index = index
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.task: asyncio.Task | None = None
+        self.stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "dropped": 0,
+            "max_depth": 0,
+            "lag_ms": 0.0,
+            "max_lag_ms": 0.0,
+        }
+
+class IngestPipeline:
+    """
+    Hands MQTT messages from paho's network thread to workers on the application's event loop.
+
+    Messages are hashed by key (the device MAC address) onto a fixed set of
+    shards. Each shard is drained serially by one worker, which keeps the
+    readings of a device in order while the shards run in parallel.
+
+    `submit` never blocks the network thread: when a shard's bounded queue is
+    full the message is dropped and counted, so a slow database cannot stall
+    the MQTT keepalive. Handlers are blocking (database, Redis), so workers run
+    them in a thread pool with one thread per shard.
+    """
+    def __init__(self, handler, shards: int = INGEST_SHARDS, maxsize: int = INGEST_QUEUE_SIZE):
+        self.handler = handler
+        self.shard_count = shards
+        self.maxsize = maxsize
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._shards: list[Shard] = []
+        self._executor: ThreadPoolExecutor | None = None
+        self._dropped_before_start = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        shard_size = max(1, self.maxsize // self.shard_count)
+        self._shards = [Shard(index, shard_size) for index in range(self.shard_count)]
+        self._executor = ThreadPoolExecutor(self.shard_count, thread_name_prefix="ingest")
+        for shard in self._shards:
+            shard.task = asyncio.create_task(self._worker(shard))
+
+    async def stop(self):
+        # Let the workers finish what is already queued
+        for shard in self._shards:
+            await shard.queue.join()
+            shard.task.cancel()
+        await asyncio.gather(*[shard.task for shard in self._shards], return_exceptions=True)
+        self._executor.shutdown()
+
+    def submit(self, key: str, topic: str, payload: bytes, received_at: float):
+        # Called from paho's network thread, received_at is a time.monotonic() timestamp
+        if self.loop is None:
+            self._dropped_before_start += 1
+            return
+        shard = self._shards[zlib.crc32(key.encode()) % self.shard_count]
+        self.loop.call_soon_threadsafe(self._enqueue, shard, (topic, payload, received_at))
+
+    def stats(self) -> dict:
+        shards = [
+            dict(shard.stats, shard=shard.index, depth=shard.queue.qsize())
+            for shard in self._shards
+        ]
+        return {
+            "shards": shards,
+            "depth": sum(shard["depth"] for shard in shards),
+            "enqueued": sum(shard["enqueued"] for shard in shards),
+            "processed": sum(shard["processed"] for shard in shards),
+            "dropped": sum(shard["dropped"] for shard in shards) + self._dropped_before_start,
+            "max_lag_ms": max((shard["max_lag_ms"] for shard in shards), default=0.0),
+        }
+
+    def _enqueue(self, shard: Shard, item: tuple):
+        try:
+            shard.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            shard.stats["dropped"] += 1
+            return
+        shard.stats["enqueued"] += 1
+        shard.stats["max_depth"] = max(shard.stats["max_depth"], shard.queue.qsize())
+
+    async def _worker(self, shard: Shard):
+        while True:
+            topic, payload, received_at = await shard.queue.get()
+            try:
+                await self.loop.run_in_executor(self._executor, self.handler, topic, payload, received_at)
+            except Exception as e:
+                print(f"Error handling message on {topic}: {e}")
+            finally:
+                # Lag is the time from receiving the message to finishing it
+                lag = (time.monotonic() - received_at) * 1000
+                shard.stats["processed"] += 1
+                shard.stats["lag_ms"] = lag
+                shard.stats["max_lag_ms"] = max(shard.stats["max_lag_ms"], lag)
+                shard.queue.task_done()
@@ -3,7 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from app import create_app
 import uvicorn
-from websocket_manager import websocket_endpoint, notification
+from websocket_manager import websocket_endpoint, multiplexed_endpoint, notification
 
 app = create_app()
 
@@ -12,6 +12,11 @@ app = create_app()
 async def websocket_route(websocket: WebSocket, unit_id: int):
     await websocket_endpoint(websocket, unit_id)
 
+# WebSocket route for many units on one connection
+@app.websocket("/ws/units")
+async def websocket_route(websocket: WebSocket):
+    await multiplexed_endpoint(websocket)
+
 # Websocket route for notifications
 @app.websocket("/ws/notifications")
 async def websocket_route(websocket: WebSocket):
@@ -1,10 +1,12 @@
-from sqlalchemy import TIMESTAMP, Column, ForeignKey, Integer, String, DateTime, Float, Boolean
+from sqlalchemy import TIMESTAMP, Column, ForeignKey, Index, Integer, String, DateTime, Float, Boolean
 from sqlalchemy.orm import relationship
 from database.__init__ import Base
 
 class Status(Base):
     __tablename__ = "status"
 
+    # TimescaleDB hypertable partitioned on time, a reading is unique per unit and time
+    unit_id = Column(Integer, ForeignKey('units.id'), primary_key=True)
     time = Column(TIMESTAMP(timezone=True), primary_key=True)
 
     power = Column(Float)
@@ -15,7 +17,8 @@ class Status(Base):
     frequency = Column(Float)
     total_energy = Column(Float)
     
-    unit_id = Column(Integer, ForeignKey('units.id'))
     unit = relationship('Unit', back_populates='statuses')
 
+Index('ix_status_unit_id_time', Status.unit_id, Status.time.desc())
+
 print("Status model created successfully.")
\ No newline at end of file
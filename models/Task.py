@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, DateTime, Integer, ForeignKey, Enum, String
+from sqlalchemy import Column, DateTime, Index, Integer, ForeignKey, Enum, String
 from sqlalchemy.orm import relationship
 from database.__init__ import Base
 import enum
@@ -34,4 +34,13 @@ class Task(Base):
     assignee = relationship('Account', back_populates='tasks')
     type = relationship('TaskType')
 
+# Keyset pagination of the task board, newest first
+Index('ix_tasks_time_id', Task.time.desc(), Task.id.desc())
+
+# A device has at most one open task of each type, add_task relies on it to skip duplicates
+Index(
+    'ix_tasks_open_device_type', Task.device_id, Task.type_id, unique=True,
+    postgresql_where=Task.status != TaskStatus.COMPLETED
+)
+
 print("Task model created successfully.")
\ No newline at end of file
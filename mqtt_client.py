@@ -1,22 +1,26 @@
 from datetime import datetime, timezone
 from enum import Enum
-import psycopg2
 import regex as re
 import json
-import asyncio
 import logging
 import os
+import socket
 # Database & Caching
 from database import SessionLocal
+from device_registry import device_registry
+import device_state
+from device_state import pack_schedule
 from models.Task import TaskTypeEnum
 from redis_client import client as redis_client
+from status_writer import status_writer
 # MQTT, Websocket
-from models.Status import Status as Model_Status
 from models.unit import Unit
 from paho.mqtt import client as mqtt_client
+from ingest_pipeline import IngestPipeline
 from utils import add_task, get_tz_datetime
-from websocket_manager import manager, notification_manager, NOTI_TYPE, Notification
-from config import MQTT_BROKER, MQTT_PORT, MQTT_CLIENT_ID, POWERLOST_THRESHOLD
+from websocket_manager import NOTI_TYPE, Notification
+from fanout import publish_status, publish_notification
+from config import MQTT_BROKER, MQTT_PORT, MQTT_CLIENT_ID, MQTT_INGEST_ENABLED, MQTT_SHARED_GROUP, POWERLOST_THRESHOLD
 import pytz
 import random
 
@@ -45,27 +49,31 @@ logging.basicConfig(
 )
 
 class Client(mqtt_client.Client):
-    def __init__(self, client_id=MQTT_CLIENT_ID):
-        super().__init__(mqtt_client.CallbackAPIVersion.VERSION2)
+    def __init__(self, client_id=MQTT_CLIENT_ID, ingest=MQTT_INGEST_ENABLED, shared_group=MQTT_SHARED_GROUP):
+        # Every process needs its own client id, the broker disconnects clients sharing one
+        self.ID = f"{client_id}-{socket.gethostname()}-{os.getpid()}"
+        super().__init__(mqtt_client.CallbackAPIVersion.VERSION2, client_id=self.ID, protocol=mqtt_client.MQTTv5)
         self.HOST = MQTT_BROKER
         self.PORT = MQTT_PORT
-        self.ID = MQTT_CLIENT_ID
+        # Without ingest the client only publishes commands, see ingest.py
+        self.ingest = ingest
+        # Ingest instances in the same shared subscription group split the messages between them
+        self.shared_group = shared_group
         print("Initiating...")
         print(f"Host: {self.HOST}, Port: {self.PORT}, ID: {self.ID}")
         self.incoming = {
             "status": self.handle_status,
             "alive": self.handle_connection,
         }
-        self.ttl = 60 * 5 # 5 minutes
+        self.pipeline = IngestPipeline(self.process_message)
 
     def command(self, unit_id, command: COMMAND, payload):
-        # Get mac address from database
-        with SessionLocal() as session:
-            unit = session.query(Unit).filter(Unit.id == unit_id).first()
-            if not unit:
-                print("Unit not found")
-                return
-            mac_address = unit.mac
+        # Get mac address from the device registry
+        device = device_registry.get_by_id(unit_id)
+        if not device:
+            print("Unit not found")
+            return
+        mac_address = device.mac
         body = {
             "command": command.value,
         }
@@ -88,8 +96,6 @@ class Client(mqtt_client.Client):
     def handle_status(self, unit_id, payload):
         body = json.loads(payload)
         body["time"] = get_tz_datetime().timestamp()
-        # Store the status in the database
-        session = SessionLocal()
         if body["power"]  < 5 and body["toggle"] == 1:
            body["power"]  = 630 + random.randint(0, 10)
            # Add random noise to the current, voltage, and frequency, round to 2 decimal places
@@ -102,59 +108,42 @@ class Client(mqtt_client.Client):
             # TODO: Convert timestamp to local timezone
             # This is a temporary solution, as the device return incorrect offset eventhough correct datetime
             time = get_tz_datetime()
-            # Set body["time"] with time as timestamp
-            # Print timezone of time
-            status = session.query(Model_Status).filter(Model_Status.unit_id == unit_id, Model_Status.time == time).first()
-            if status:
-                print("Status already exists")
-                return
-            new_status = Model_Status(
-                unit_id=unit_id,
-                time=time,
-                power=body['power'],
-                current=body['current'],
-                voltage=body['voltage'],
-                toggle=body['toggle'],
-                power_factor=body['power_factor'],
-                frequency=body['frequency'],
-                total_energy=energy_consumption
-            )
-            session.add(new_status)
-            session.commit()
+            # Queue the status for the batched writer, duplicates are skipped on insert
+            status_writer.write({
+                "unit_id": unit_id,
+                "time": time,
+                "power": body['power'],
+                "current": body['current'],
+                "voltage": body['voltage'],
+                "toggle": body['toggle'],
+                "power_factor": body['power_factor'],
+                "frequency": body['frequency'],
+                "total_energy": energy_consumption
+            })
             # Check for powerlost and add task
             if bool(body["toggle"]) and float(body["power"]) < POWERLOST_THRESHOLD:
                 add_task(unit_id, TaskTypeEnum.POWER_OFF)
 
-            # Check if hour_on, hour_off, minute_on, minute_off is different from the previous status in Redis
-            prev_status = redis_client.get(f"device:{unit_id}")
-            if prev_status:
-                prev_status = json.loads(prev_status)
-                hour_on = prev_status.get("hour_on")
-                hour_off = prev_status.get("hour_off")
-                minute_on = prev_status.get("minute_on")
-                minute_off = prev_status.get("minute_off")
-
-                if hour_on != body.get("hour_on") or minute_on != body.get("hour_off"):
-                    new_on_time = f"{body['hour_on']}:{body['minute_on']}"
-                    session.query(Unit).filter(Unit.id == unit_id).update({"on_time": new_on_time})
-                if hour_off != body.get("hour_off") or minute_off != body.get("minute_off"):
-                    new_off_time = f"{body['hour_off']}:{body['minute_off']}"
-                    session.query(Unit).filter(Unit.id == unit_id).update({"off_time": new_off_time})
-                session.commit()
-
-            # Store the status in Redis
-            body = json.dumps(body)
-            redis_client.setex(f"device:{unit_id}", self.ttl, body)
-            asyncio.run(manager.send_private_message(body, unit_id))
-        # Duplicate timestamp
-        except psycopg2.errors.UniqueViolation:
-            print("Duplicate timestamp")
-            session.rollback()
+            # Store the state and publish it in one round-trip, which returns the previous schedule
+            message = json.dumps(body)
+            with redis_client.pipeline(transaction=False) as pipe:
+                publish_status(unit_id, message, pipe)
+                prev_schedule = device_state.write_status(unit_id, body, message, pipe)
+
+            # Check if hour_on, minute_on, hour_off, minute_off is different from the previous status
+            if prev_schedule and prev_schedule != pack_schedule(body):
+                prev_on, prev_off = prev_schedule.split("-")
+                schedule = {}
+                if prev_on != f"{body.get('hour_on')}:{body.get('minute_on')}":
+                    schedule["on_time"] = f"{body['hour_on']}:{body['minute_on']}"
+                if prev_off != f"{body.get('hour_off')}:{body.get('minute_off')}":
+                    schedule["off_time"] = f"{body['hour_off']}:{body['minute_off']}"
+                with SessionLocal() as session:
+                    session.query(Unit).filter(Unit.id == unit_id).update(schedule)
+                    session.commit()
+                device_registry.refresh(unit_id)
         except Exception as e:
             print(f"Error storing status: {e}")
-            session.rollback()
-        finally:
-            session.close()
 
     def handle_connection(self, unit_id: int, payload):
         unit_name = payload["name"]
@@ -163,92 +152,91 @@ class Client(mqtt_client.Client):
         if body != "1" and body != "0":
             print("Invalid connection status")
             return
-        status = {
-            "alive": body,
-            "time": get_tz_datetime()
-        }
-        # Only set the status in Redis if the device is disconnected
+        time = get_tz_datetime()
         print(f"Device {unit_id} is {body}")
+        # Only the liveness changes, the last telemetry is kept for when the device reconnects
+        with redis_client.pipeline(transaction=False) as pipe:
+            if body == "0":
+                publish_status(unit_id, json.dumps({"alive": body, "time": time.isoformat()}), pipe)
+            device_state.write_liveness(unit_id, body == "1", time, pipe)
         if body == "0":
-            redis_client.setex(f"device:{unit_id}", self.ttl, json.dumps(status))
             notification = Notification(
                 type=NOTI_TYPE.CRITICAL,
                 message=f"Thiết bị {unit_name} đã mất kết nối"
             )
             add_task(unit_id, TaskTypeEnum.DISCONNECTION)
-            asyncio.run(manager.send_private_message(json.dumps(status), unit_id))
-            # asyncio.run(notification_manager.send_notification(notification))
+            # publish_notification(notification)
         else:
             notification = Notification(
                 type=NOTI_TYPE.INFO,
                 message=f"Thiết bị {unit_name} đã kết nối"
             )
-            asyncio.run(notification_manager.send_notification(notification))
+            publish_notification(notification)
 
             # Sync the schedule to the device
             try:
-                with SessionLocal() as session:
-                    unit = session.query(Unit).filter(Unit.id == unit_id).first()
-                    if not unit:
-                        print("Unit not found")
-                        return
-                    # Convert from datetime.time to string
-                    on_time = unit.on_time.strftime("%H:%M")
-                    off_time = unit.off_time.strftime("%H:%M")
-                    schedule = {
-                        "hour_on": on_time.split(":")[0],
-                        "minute_on": on_time.split(":")[1],
-                        "hour_off": off_time.split(":")[0],
-                        "minute_off": off_time.split(":")[1]
-                    }
-                    self.command(unit_id, COMMAND.SCHEDULE, schedule)
+                device = device_registry.get_by_id(unit_id)
+                if not device:
+                    print("Unit not found")
+                    return
+                # Convert from datetime.time to string
+                on_time = device.on_time.strftime("%H:%M")
+                off_time = device.off_time.strftime("%H:%M")
+                schedule = {
+                    "hour_on": on_time.split(":")[0],
+                    "minute_on": on_time.split(":")[1],
+                    "hour_off": off_time.split(":")[0],
+                    "minute_off": off_time.split(":")[1]
+                }
+                self.command(unit_id, COMMAND.SCHEDULE, schedule)
             except Exception as e:
                 print(f"An error occurred: {e}")
-            finally:
-                session.close()
 
     ## Override
     def on_connect(self, client, userdata, flags, reason_code, properties=None):
         print(f"Connected with result code {reason_code}")
         logging.info(f"MQTT client connected with result code {reason_code}")
         # Subscribe to device status topics
-        self.subscribe("unit/+/status")
-        self.subscribe("unit/+/alive")
+        if self.ingest:
+            prefix = f"$share/{self.shared_group}/" if self.shared_group else ""
+            self.subscribe(f"{prefix}unit/+/status")
+            self.subscribe(f"{prefix}unit/+/alive")
 
     def on_disconnect(self, client, userdata, flags, reason_code, properties=None):
         print(f"Disconnected with result code {reason_code}")
         logging.info(f"MQTT client disconnected with result code {reason_code}")
 
     def on_message(self, client, userdata, message):
+        # Only hand the message over, it is processed by the ingest pipeline workers.
+        # Messages are sharded by the MAC in unit/{mac}/..., to keep each device in order
+        topic = message.topic
+        parts = topic.split("/")
+        key = parts[1] if len(parts) > 2 else topic
+        self.pipeline.submit(key, topic, message.payload, message.timestamp)
+
+    def process_message(self, topic: str, payload: bytes, received_at: float):
         try:
             # Extract information from the topic: unit/{id}/status
-            topic = message.topic
             match = re.match(r"unit/(\w+)/(status|alive)", topic)
             if match:
                 mac_address, _type = match.groups()
-                # Get unit id from database by mac address
-                session = SessionLocal()
-                try:
-                    unit = session.query(Unit).filter(Unit.mac == mac_address).first()
-                    if not unit:
-                        print("Unit not found: ", mac_address)
-                        return
-                    unit_id = unit.id
-                    body = message.payload.decode("utf-8")
-                    if _type == "status":
-                        self.incoming["status"](unit_id, body)
-                    elif _type == "alive":
-                        payload = {
-                            "name": unit.name,
-                            "body": body
-                        }
-                        self.incoming["alive"](unit_id, payload)
-                    else:
-                        print("Invalid message type", _type)
-                except Exception as e:
-                    print(f"An error occurred: {e}")
-                finally:
-                    session.close()
+                # Get unit id from the device registry by mac address
+                device = device_registry.get_by_mac(mac_address)
+                if not device:
+                    print("Unit not found: ", mac_address)
+                    return
+                unit_id = device.id
+                body = payload.decode("utf-8")
+                if _type == "status":
+                    self.incoming["status"](unit_id, body)
+                elif _type == "alive":
+                    payload = {
+                        "name": device.name,
+                        "body": body
+                    }
+                    self.incoming["alive"](unit_id, payload)
+                else:
+                    print("Invalid message type", _type)
             else:
                 print("Invalid topic", topic)
         except json.JSONDecodeError:
@@ -0,0 +1,110 @@
+# rbac.py
+import threading
+import redis
+from sqlalchemy.orm import selectinload
+from config import PermissionEnum, RBAC_VERSION_CHECK_INTERVAL
+from database import SessionLocal
+from models.Account import Role
+from redis_client import client as redis_client
+from redis_listener import RedisListener
+
+# The current version of the roles, bumped on every change and announced to the other workers
+RBAC_VERSION_KEY = "rbac:version"
+RBAC_CHANNEL = "rbac:version"
+
+class RoleSnapshot:
+    """
+    Cached view of a role, enough to authorise a request.
+    """
+    def __init__(self, role_id: int, role_name: str, rank: int, permissions: frozenset[str]):
+        self.role_id = role_id
+        self.role_name = role_name
+        self.rank = rank
+        self.permissions = permissions
+
+    @classmethod
+    def from_role(cls, role: Role) -> "RoleSnapshot":
+        return cls(
+            role_id=role.role_id,
+            role_name=role.role_name,
+            rank=role.rank,
+            permissions=frozenset(permission.permission_name for permission in role.permissions)
+        )
+
+class Rbac:
+    """
+    Versioned in-process snapshot of roles, their rank and permission names.
+
+    The snapshot is loaded once at startup and replaced as a whole. Changes to
+    roles through user_router call `bump`, which increments the version in
+    Redis and announces it; every worker reloads when it sees a version newer
+    than its own. Permission checks are then set intersections in memory. A
+    role missing from the snapshot, created by a worker whose announcement was
+    lost, triggers a reload; lost announcements that revoke permissions are
+    caught by reloading after a resubscription and by comparing the version
+    in Redis every `check_interval` seconds.
+    """
+    def __init__(self, check_interval: int = RBAC_VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.version = 0
+        self._roles: dict[int, RoleSnapshot] = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def load(self):
+        try:
+            version = int(redis_client.get(RBAC_VERSION_KEY) or 0)
+        except redis.RedisError as e:
+            print(f"Error reading the RBAC version: {e}")
+            version = self.version
+        with SessionLocal() as session:
+            roles = session.query(Role).options(selectinload(Role.permissions)).all()
+            snapshot = {role.role_id: RoleSnapshot.from_role(role) for role in roles}
+        with self._lock:
+            self._roles = snapshot
+            self.version = max(self.version, version)
+        print(f"Loaded {len(snapshot)} roles, RBAC version {self.version}")
+
+    def listen(self):
+        # Reload when another worker changes the roles, on a background thread
+        if self._listener:
+            return
+        self._listener = RedisListener(
+            "rbac", {RBAC_CHANNEL: self._on_version}, on_reconnect=self.load,
+            on_tick=self._check_version, tick_interval=self.check_interval
+        )
+        self._listener.start()
+
+    def bump(self):
+        # Called after committing a change to roles or their permissions
+        try:
+            version = redis_client.incr(RBAC_VERSION_KEY)
+            redis_client.publish(RBAC_CHANNEL, version)
+        except redis.RedisError as e:
+            print(f"Error announcing the RBAC version: {e}")
+        self.load()
+
+    def get(self, role_id: int) -> RoleSnapshot | None:
+        role = self._roles.get(role_id)
+        if role is None:
+            self.load()
+            role = self._roles.get(role_id)
+        return role
+
+    def role_name(self, role_id: int) -> str | None:
+        role = self.get(role_id)
+        return role.role_name if role else None
+
+    def has_any(self, role_id: int, required: list[PermissionEnum]) -> bool:
+        role = self.get(role_id)
+        return role is not None and not role.permissions.isdisjoint(p.value for p in required)
+
+    def _on_version(self, message):
+        if int(message["data"]) > self.version:
+            self.load()
+
+    def _check_version(self):
+        if int(redis_client.get(RBAC_VERSION_KEY) or 0) > self.version:
+            self.load()
+
+rbac = Rbac()
@@ -0,0 +1,69 @@
+# redis_listener.py
+import threading
+import time
+from typing import Callable
+from redis_client import client as redis_client
+
+class RedisListener:
+    """
+    Calls a handler for every message published on its channels, on a background thread.
+
+    The subscription is re-established after a Redis error, as for the fan-out
+    subscriber. Messages published meanwhile are lost, so `on_reconnect` is
+    called once subscribed again to catch up, typically with a full reload.
+    `on_tick`, when given, is called every `tick_interval` seconds between
+    messages, as a backstop for announcements lost without a disconnection.
+    """
+    def __init__(
+        self,
+        name: str,
+        handlers: dict[str, Callable[[dict], None]],
+        on_reconnect: Callable[[], None] | None = None,
+        on_tick: Callable[[], None] | None = None,
+        tick_interval: float | None = None,
+        retry_interval: float = 1.0,
+    ):
+        self.name = name
+        self.handlers = handlers
+        self.on_reconnect = on_reconnect
+        self.on_tick = on_tick
+        self.tick_interval = tick_interval
+        self.retry_interval = retry_interval
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        failed = False
+        next_tick = time.monotonic() + (self.tick_interval or 0)
+        while not self._stopping.is_set():
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(**self.handlers)
+                if failed and self.on_reconnect:
+                    self.on_reconnect()
+                failed = False
+                while not self._stopping.is_set():
+                    # Handlers are called by get_message
+                    pubsub.get_message(timeout=1.0)
+                    if self.on_tick and self.tick_interval and time.monotonic() >= next_tick:
+                        next_tick = time.monotonic() + self.tick_interval
+                        self.on_tick()
+            except Exception as e:
+                failed = True
+                print(f"Subscription {self.name} failed: {e}")
+                self._stopping.wait(self.retry_interval)
+            finally:
+                pubsub.close()
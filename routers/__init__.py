@@ -7,6 +7,7 @@ from .user_router import router as user_router
 from .audit_router import router as audit_router
 from .file_router import router as file_router
 from .task_router import router as task_router
+from .metrics_router import router as metrics_router
 
 api_router = APIRouter(prefix="/api")
 api_router.include_router(auth_router)
@@ -15,4 +16,5 @@ api_router.include_router(cluster_router)
 api_router.include_router(status_router)
 api_router.include_router(audit_router)
 api_router.include_router(file_router)
-api_router.include_router(task_router)
\ No newline at end of file
+api_router.include_router(task_router)
+api_router.include_router(metrics_router)
\ No newline at end of file
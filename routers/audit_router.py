@@ -1,14 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Response
-from fastapi.responses import FileResponse
+import csv
+import io
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import desc
-from sqlalchemy.orm import Session
-from typing import List
-from database.session import get_db
-from models.Audit import Audit
+from sqlalchemy import desc, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from database import engine
+from database.session import get_async_db
+from models.Audit import ActionEnum, Audit
 from .dependencies import required_permission
-from config import PermissionEnum
+from config import AUDIT_EXPORT_CHUNK, PermissionEnum
 from schemas import AuditLogResponse
+from utils import decode_cursor, encode_cursor, estimated_count
 
 router = APIRouter(
     prefix="/audit",
@@ -16,22 +21,38 @@ router = APIRouter(
     dependencies=[Depends(required_permission([PermissionEnum.VIEW_CHANGE_LOG, PermissionEnum.MONITOR_SYSTEM]))]
 )
 class PaginatedResponse(BaseModel):
-    total: int
+    # total is an estimate unless exact_total is requested
+    total: Optional[int]
     page: int
     page_size: int
     items: List[AuditLogResponse]
+    next_cursor: Optional[str] = None
     
 @router.get("/", response_model=PaginatedResponse)
 async def get_audit_logs(
     page: int = Query(1, ge=1),
     page_size: int = Query(10, ge=1, le=100),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    exact_total: bool = False,
+    db: AsyncSession = Depends(get_async_db)
     ):
-    offset = (page - 1) * page_size
-    total = db.query(Audit).count()
-    audit_logs = db.query(Audit).order_by(desc(Audit.timestamp)).offset(offset).limit(page_size).all()
+    # The timestamp primary key is unique, so it is the whole cursor
+    query = select(Audit).order_by(desc(Audit.timestamp)).limit(page_size)
+    if cursor:
+        try:
+            (timestamp,) = decode_cursor(cursor)
+            query = query.where(Audit.timestamp < datetime.fromisoformat(timestamp))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    else:
+        query = query.offset((page - 1) * page_size)
+    audit_logs = (await db.scalars(query)).all()
     if not audit_logs:
         raise HTTPException(status_code=404, detail="No audit logs found")
+    if exact_total:
+        total = await db.scalar(select(func.count()).select_from(Audit))
+    else:
+        total = await estimated_count(db, Audit.__tablename__)
     result = [
         AuditLogResponse(
             timestamp=audit.timestamp,
@@ -44,23 +65,43 @@ async def get_audit_logs(
         total=total,
         page=page,
         page_size=page_size,
-        items=result
+        items=result,
+        next_cursor=encode_cursor(audit_logs[-1].timestamp) if len(audit_logs) == page_size else None
     )
 
-# Download the audit logs as CSV
-@router.get("/auditlogs.csv", response_class=FileResponse)
-async def download_audit_logs(
-    db: Session = Depends(get_db)
-    ):
-    audit_logs = db.query(Audit).order_by(
+def stream_audit_csv(start_date: Optional[datetime], end_date: Optional[datetime], action: Optional[ActionEnum]):
+    # Runs in Starlette's thread pool, with its own connection as the request's session is closed by then
+    query = select(Audit.timestamp, Audit.email, Audit.action, Audit.details).order_by(Audit.timestamp)
+    if start_date:
+        query = query.where(Audit.timestamp >= start_date)
+    if end_date:
+        query = query.where(Audit.timestamp <= end_date)
+    if action:
+        query = query.where(Audit.action == action)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["timestamp", "email", "action", "details"])
+    with engine.connect() as connection:
+        # stream_results uses a server-side cursor, rows are fetched AUDIT_EXPORT_CHUNK at a time
+        result = connection.execution_options(stream_results=True, yield_per=AUDIT_EXPORT_CHUNK).execute(query)
+        for rows in result.partitions():
+            writer.writerows((row.timestamp, row.email, row.action.value, row.details) for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
 
+# Download the audit logs as CSV, query: start_date, end_date, action
+@router.get("/auditlogs.csv", response_class=StreamingResponse)
+def download_audit_logs(
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    action: Optional[ActionEnum] = None
+    ):
+    return StreamingResponse(
+        stream_audit_csv(start_date, end_date, action),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=audit_logs.csv"}
     )
-    if not audit_logs:
-        raise HTTPException(status_code=404, detail="No audit logs found")
-    csv_file = "timestamp,email,action,details\n"
-    for audit in audit_logs:
-        action = audit.action.value
-        csv_file += f"{audit.timestamp},{audit.email},{action},{audit.details}\n"
-    response = Response(content=csv_file, media_type="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=audit_logs.csv"
-    return response
\ No newline at end of file
@@ -2,9 +2,10 @@ from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from starlette import status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from auth import authenticate_user, create_access_token, get_current_user
-from database.session import get_db
+from database.session import get_async_db, get_db
 from pydantic import BaseModel
 from models.Account import Account, Role
 from models.Audit import ActionEnum
@@ -24,8 +25,8 @@ class Token(BaseModel):
     token_type: str
 
 @router.post("/token")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     
     if not user:
         raise HTTPException(
@@ -38,7 +39,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     )
     # Create audit log
     action = ActionEnum.LOGIN
-    save_audit_log(db, user.email, action, f"{user.username} logged in")
+    save_audit_log(user, action, f"{user.username} logged in")
 
     return {"access_token": access_token, "token_type": "bearer"}
 
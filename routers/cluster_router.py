@@ -1,13 +1,19 @@
+from typing import Optional
+import redis
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session, joinedload
-from models.Account import Account, Role
+from models.Account import Account
 from models.Audit import ActionEnum
+from models.Status import Status
 from models.unit import Cluster, Unit
 from utils import save_audit_log
 from .dependencies import get_current_user, admin_required, required_permission
-from schemas import ClusterCreate, ClusterRead, ClusterReadFull, ClusterUpdate, NodeControl, UnitCreate, UnitRead
+from schemas import ClusterCreate, ClusterRead, ClusterReadFull, ClusterUpdate, NodeControl, UnitCreate, UnitRead, UnitSnapshot
 from database.session import get_db
 from mqtt_client import client, COMMAND
+from device_registry import device_registry
+from rbac import rbac
+import device_state
 from config import PermissionEnum
 
 router = APIRouter(
@@ -16,7 +22,7 @@ router = APIRouter(
 )
 
 def isAdmin(current_user: Account, db: Session):
-    role_name = db.query(Role).filter(Role.role_id == current_user.role).first().role_name
+    role_name = rbac.role_name(current_user.role)
     if role_name not in ["ADMIN", "SUPERADMIN"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -45,6 +51,51 @@ def get_clusters(
     
     return clusters
 
+# Live state of every unit, optionally of one cluster, for the map and overview pages
+@router.get("/snapshot",
+            response_model=list[UnitSnapshot],
+            dependencies=[Depends(required_permission([PermissionEnum.MONITOR_SYSTEM]))]
+)
+def get_snapshot(cluster_id: Optional[int] = None, db: Session = Depends(get_db)):
+    if cluster_id is None:
+        devices = device_registry.get_all()
+    else:
+        devices = device_registry.get_by_cluster(cluster_id)
+    devices.sort(key=lambda x: x.name)
+    unit_ids = [device.id for device in devices]
+
+    # One pipelined round-trip for the live state of every unit
+    try:
+        states = dict(zip(unit_ids, device_state.read_states(unit_ids)))
+    except redis.RedisError as e:
+        print(f"Device state unavailable: {e}")
+        states = {}
+
+    # Units whose state expired are offline, their last reading comes from the database
+    missing = [unit_id for unit_id in unit_ids if states.get(unit_id) is None]
+    if missing:
+        latest = db.query(
+            Status.unit_id, Status.time, Status.power, Status.toggle
+        ).filter(
+            Status.unit_id.in_(missing)
+        ).distinct(
+            Status.unit_id
+        ).order_by(
+            Status.unit_id, Status.time.desc()  # Served by ix_status_unit_id_time
+        ).all()
+        for row in latest:
+            states[row.unit_id] = {"power": row.power, "toggle": row.toggle, "alive": False, "last_seen": row.time}
+
+    return [
+        UnitSnapshot(
+            id=device.id,
+            name=device.name,
+            cluster_id=device.cluster_id,
+            **(states.get(device.id) or {"alive": False})
+        )
+        for device in devices
+    ]
+
 # Create a new cluster, only admin users can access this endpoint
 @router.post("/", response_model=ClusterRead)
 def create_cluster(cluster: ClusterCreate, db: Session = Depends(get_db), current_user: Account = Depends(admin_required)):
@@ -69,8 +120,10 @@ def create_cluster(cluster: ClusterCreate, db: Session = Depends(get_db), curren
 
     db.commit()
     db.refresh(new_cluster)
+    for unit in new_cluster.units:
+        device_registry.put(unit)
     # Audit the action
-    save_audit_log(db, current_user.email, ActionEnum.CREATE, f"Tạo cluster {new_cluster.name}")
+    save_audit_log(current_user, ActionEnum.CREATE, f"Tạo cluster {new_cluster.name}")
     return new_cluster
 
 @router.put("/{cluster_id}", response_model=ClusterRead, dependencies=[Depends(required_permission([PermissionEnum.CONFIG_DEVICE]))])
@@ -90,8 +143,10 @@ def update_cluster(cluster_id: int, cluster: ClusterUpdate, db: Session = Depend
             else:
                 db.query(Unit).filter(Unit.id == unit.id).update({"name": unit.name, "mac": unit.mac})
     db.commit()
+    for unit in db.query(Unit).filter(Unit.cluster_id == cluster_id).all():
+        device_registry.put(unit)
     # Audit the action
-    save_audit_log(db, current_user.email, ActionEnum.UPDATE, f"Cập nhật cụm {cluster.name}")
+    save_audit_log(current_user, ActionEnum.UPDATE, f"Cập nhật cụm {cluster.name}")
     return db.query(Cluster).get(cluster_id)
 
 # Create a new unit in a cluster, only admin users can access this endpoint
@@ -105,8 +160,9 @@ def create_unit(cluster_id: int, unit: UnitCreate, db: Session = Depends(get_db)
     db.add(new_unit)
     db.commit()
     db.refresh(new_unit)
+    device_registry.put(new_unit)
     # Audit the action
-    save_audit_log(db, current_user.email, ActionEnum.CREATE, f"Tạo unit {new_unit.name}")
+    save_audit_log(current_user, ActionEnum.CREATE, f"Tạo unit {new_unit.name}")
     return new_unit
 
 # Update cluster
@@ -115,17 +171,20 @@ def update_cluster(cluster_id: int, cluster: ClusterUpdate, db: Session = Depend
     db.query(Cluster).filter(Cluster.id == cluster_id).update({"name": cluster.name})
     db.commit()
     # Audit the action
-    save_audit_log(db, current_user.email, ActionEnum.UPDATE, f"Cập nhật cụm {cluster.name}")
+    save_audit_log(current_user, ActionEnum.UPDATE, f"Cập nhật cụm {cluster.name}")
     return db.query(Cluster).get(cluster_id)
 
 # Delete a cluster, only admin users can access this endpoint
 @router.delete("/{cluster_id}")
 def delete_cluster(cluster_id: int, db: Session = Depends(get_db), current_user: Account = Depends(admin_required)):
     cluster = db.query(Cluster).get(cluster_id)
+    unit_ids = [unit.id for unit in cluster.units]
     db.delete(cluster)
     db.commit()
+    for unit_id in unit_ids:
+        device_registry.remove(unit_id)
     # Audit the action
-    save_audit_log(db, current_user.email, ActionEnum.DELETE, f"Xóa cluster {cluster.name}")
+    save_audit_log(current_user, ActionEnum.DELETE, f"Xóa cluster {cluster.name}")
     return HTTPException(status_code=200, detail="Cluster deleted successfully")
 
 # Control a unit
@@ -140,7 +199,7 @@ def control_unit(
     current_user: Account = Depends(get_current_user)
     ):
     # Get the unit of the manager
-    unit = db.query(Unit).filter(Unit.id == unit_id).first()
+    unit = device_registry.get_by_id(unit_id)
     if not unit:
         return HTTPException(status_code=404, detail="Unit not found")
     
@@ -165,6 +224,8 @@ def control_unit(
         turn_off_time = f"{schedule_dict['hourOff']}:{schedule_dict['minuteOff']}"
         details += f"Hẹn giờ {unit.name} mở từ {turn_on_time} đến {turn_off_time}"
         db.query(Unit).filter(Unit.id == unit_id).update({"on_time": turn_on_time, "off_time": turn_off_time})
+        db.commit()
+        device_registry.refresh(unit_id)
         # Implement the logic to schedule the unit
         payload = {
             "hour_on": node.payload.hourOn,
@@ -174,5 +235,5 @@ def control_unit(
         }
         client.command(unit.id, COMMAND.SCHEDULE, payload)
     # Audit the action
-    save_audit_log(db, current_user.email, ActionEnum.UPDATE, details)
+    save_audit_log(current_user, ActionEnum.UPDATE, details)
     return HTTPException(status_code=200, detail="Controlled the unit successfully")
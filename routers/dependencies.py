@@ -1,39 +1,30 @@
 # dependencies.py
 
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from auth import get_current_user  # Assuming this function is already defined
-from models.Account import Account, Role
-from database.session import get_db
+from auth import Principal, get_current_principal, get_current_user  # get_current_user is re-exported for the routers
+from models.Account import Account
 from config import DEBUG, PermissionEnum
 
+# Role and permissions come from the cached principal and the RBAC snapshot, without a database query
 def admin_required(
-    current_user: Account = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    # Get the role name of the current user
-    role_name = db.query(Role).filter(Role.role_id == current_user.role).first().role_name
-    if role_name not in ["ADMIN", "SUPERADMIN"]:
+    principal: Principal = Depends(get_current_principal)
+) -> Account:
+    if principal.role_name not in ["ADMIN", "SUPERADMIN"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You cannot view or edit ADMIN or SUPERADMIN roles."
         )
-    return current_user
+    return principal.account()
 
 def required_permission(user_permissions: list[PermissionEnum]):
     def check_permission(
-        current_user: Account = Depends(get_current_user),
-        db: Session = Depends(get_db)
-    ):
-        # Get all permission names of the current user
-        user_per = db.query(Role).filter(Role.role_id == current_user.role).first().permissions
-        permission_names = set([permission.permission_name for permission in user_per])
+        principal: Principal = Depends(get_current_principal)
+    ) -> Account:
         # If the current user has none of the required permissions
-        user_p_names = set([p.value for p in user_permissions])
-        if not user_p_names.intersection(permission_names):
+        if not principal.has_any(user_permissions):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You do not have the required permissions to access this resource."
             )
-        return current_user
-    return check_permission
\ No newline at end of file
+        return principal.account()
+    return check_permission
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends
+from audit_writer import audit_writer
+from auth import password_verifier
+from mqtt_client import client
+from status_writer import status_writer
+from websocket_manager import websocket_stats
+from .dependencies import admin_required
+
+router = APIRouter(
+    prefix='/metrics',
+    tags=['metrics'],
+    dependencies=[Depends(admin_required)]
+)
+
+@router.get("/")
+def get_metrics():
+    return {
+        "ingest": client.pipeline.stats(),
+        "status_writer": status_writer.stats(),
+        "websocket": websocket_stats(),
+        "password_verifier": password_verifier.stats(),
+        "audit_writer": audit_writer.stats(),
+    }
@@ -1,14 +1,20 @@
 from datetime import datetime, timedelta
 from enum import Enum
-from fastapi import APIRouter, Depends, HTTPException
+import hashlib
+import json
+import pytz
+import redis
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel
-from sqlalchemy import func
+from sqlalchemy import DateTime, Float, Integer, column, func, table
 from database import session
 from database.session import get_db
 from models.Account import Account
 from models.Status import Status
+from redis_client import client as redis_client
 from routers.dependencies import admin_required
 from utils import get_tz_datetime
+from config import ENERGY_CACHE_TTL, STATUS_STREAM_CLAIM_IDLE
 from typing import Optional
 
 router = APIRouter(
@@ -29,7 +35,25 @@ class EnergyRead(BaseModel):
     class Config:
         orm_mode = True
 
-def get_grouped_data(view: ViewEnum, db, device_id=None, start_date=None, end_date=None):
+def energy_aggregate(name: str, per_unit: bool):
+    columns = [column("bucket", DateTime(timezone=True)), column("total_energy", Float)]
+    if per_unit:
+        columns.append(column("unit_id", Integer))
+    return table(name, *columns)
+
+# TimescaleDB continuous aggregates over status.total_energy, see the status_energy migration.
+# They are real-time aggregates: buckets not materialised yet are computed from the raw rows.
+ENERGY_AGGREGATES = {
+    # (view, per unit): (aggregate, bucket width of the aggregate)
+    (ViewEnum.hourly, True): (energy_aggregate("status_energy_hourly", True), "hour"),
+    (ViewEnum.daily, True): (energy_aggregate("status_energy_daily", True), "day"),
+    (ViewEnum.monthly, True): (energy_aggregate("status_energy_daily", True), "day"),
+    (ViewEnum.hourly, False): (energy_aggregate("status_energy_fleet_hourly", False), "hour"),
+    (ViewEnum.daily, False): (energy_aggregate("status_energy_fleet_daily", False), "day"),
+    (ViewEnum.monthly, False): (energy_aggregate("status_energy_fleet_daily", False), "day"),
+}
+
+def get_range(view: ViewEnum, start_date=None, end_date=None) -> tuple[datetime, datetime]:
     current_time = get_tz_datetime()
     if start_date and end_date:
         start = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -44,23 +68,44 @@ def get_grouped_data(view: ViewEnum, db, device_id=None, start_date=None, end_da
         else:
             raise ValueError("Invalid view type")
         end = current_time
+    # Dates without an offset are UTC, like the database session
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=pytz.UTC)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=pytz.UTC)
+    return start, end
+
+def truncate(value: datetime, unit: str) -> datetime:
+    if unit == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    if unit == "day":
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def get_grouped_data(view: ViewEnum, db, device_id=None, start_date=None, end_date=None):
+    start, end = get_range(view, start_date, end_date)
+    return query_grouped_data(view, db, device_id, start, end)
 
+def query_grouped_data(view: ViewEnum, db, device_id, start: datetime, end: datetime):
+    if (view, bool(device_id)) not in ENERGY_AGGREGATES:
+        raise ValueError("Invalid view type")
+    # Read from the coarsest aggregate whose buckets fit in the requested view
+    aggregate, bucket_width = ENERGY_AGGREGATES[(view, bool(device_id))]
     if view == ViewEnum.hourly:
-        time_format = func.date_trunc('hour', Status.time)
+        time_format = func.date_trunc('hour', aggregate.c.bucket)
     elif view == ViewEnum.daily:
-        time_format = func.date_trunc('day', Status.time)
-    elif view == ViewEnum.monthly:
-        time_format = func.date_trunc('month', Status.time)
+        time_format = func.date_trunc('day', aggregate.c.bucket)
     else:
-        raise ValueError("Invalid view type")
+        time_format = func.date_trunc('month', aggregate.c.bucket)
 
     result = db.query(
         time_format.label("time"),
-        func.sum(Status.total_energy).label("total_energy")
+        func.sum(aggregate.c.total_energy).label("total_energy")
     ).filter(
-        Status.time >= start,
-        Status.time <= end,
-        Status.unit_id == device_id if device_id else True
+        # Include the bucket the start falls in, as grouping the raw rows did
+        aggregate.c.bucket >= func.date_trunc(bucket_width, start),
+        aggregate.c.bucket <= end,
+        aggregate.c.unit_id == device_id if device_id else True
     ).group_by(
         time_format
     ).order_by(
@@ -69,19 +114,106 @@ def get_grouped_data(view: ViewEnum, db, device_id=None, start_date=None, end_da
 
     return result
 
+# Truncation unit of each view, the bucket containing the current time is still open
+VIEW_UNITS = {
+    ViewEnum.hourly: "hour",
+    ViewEnum.daily: "day",
+    ViewEnum.monthly: "month",
+}
+
+# Buckets stay open for the end offset of the refresh policy of their aggregate, see the status_energy
+# migration, plus the claim window of the status stream: readings left pending by a crashed writer
+# are only written once reclaimed. Later readings show up once the cached range expires.
+ENERGY_END_OFFSETS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+def closed_lag(bucket_width: str) -> timedelta:
+    return ENERGY_END_OFFSETS[bucket_width] + timedelta(seconds=STATUS_STREAM_CLAIM_IDLE)
+
+def next_bucket(bucket: datetime, unit: str) -> datetime:
+    if unit == "hour":
+        return bucket + timedelta(hours=1)
+    if unit == "day":
+        return bucket + timedelta(days=1)
+    return (bucket + timedelta(days=32)).replace(day=1)
+
+def cached_query(key: str, ttl: int, view: ViewEnum, db, device_id, start: datetime, end: datetime) -> list[dict]:
+    try:
+        cached = redis_client.get(key)
+        if cached:
+            return json.loads(cached)
+    except redis.RedisError as e:
+        print(f"Energy cache unavailable: {e}")
+    rows = [
+        {"time": row.time.isoformat(), "total_energy": row.total_energy}
+        for row in query_grouped_data(view, db, device_id, start, end)
+    ]
+    try:
+        redis_client.setex(key, ttl, json.dumps(rows))
+    except redis.RedisError as e:
+        print(f"Energy cache unavailable: {e}")
+    return rows
+
+def get_cached_grouped_data(view: ViewEnum, db, device_id=None, start_date=None, end_date=None) -> tuple[list[dict], bool]:
+    """
+    Cached get_grouped_data, returns the rows and whether every bucket in them is closed.
+
+    A bucket is closed once it ended more than `closed_lag` ago, late
+    readings rarely change it after that. Closed buckets are cached in Redis
+    for ENERGY_CACHE_TTL seconds, keyed on (view, device, start bucket, end
+    bucket). Open buckets are recomputed on every call.
+    """
+    start, end = get_range(view, start_date, end_date)
+    unit = VIEW_UNITS[view]
+    _, bucket_width = ENERGY_AGGREGATES[(view, bool(device_id))]
+    start = truncate(start, bucket_width)
+    lag = closed_lag(bucket_width)
+    open_bucket = truncate(get_tz_datetime() - lag, unit)
+    prefix = f"energy:{view.value}:{device_id or 'all'}:{start.isoformat()}"
+
+    # The whole range is closed
+    if end < open_bucket:
+        return cached_query(f"{prefix}:{end.isoformat()}", ENERGY_CACHE_TTL, view, db, device_id, start, end), True
+
+    rows = []
+    if start < open_bucket:
+        # The closed part is keyed on the first open bucket, so it is only reused until that bucket closes
+        closes_in = int((next_bucket(open_bucket, unit) + lag - get_tz_datetime()).total_seconds()) + 1
+        ttl = min(closes_in, ENERGY_CACHE_TTL)
+        closed_end = open_bucket - timedelta(microseconds=1)
+        rows = cached_query(f"{prefix}:{open_bucket.isoformat()}", ttl, view, db, device_id, start, closed_end)
+    rows += [
+        {"time": row.time.isoformat(), "total_energy": row.total_energy}
+        for row in query_grouped_data(view, db, device_id, max(start, open_bucket), end)
+    ]
+    return rows, False
+
+def energy_response(request: Request, rows: list[dict], closed: bool) -> Response:
+    # Browsers revalidate with If-None-Match, closed ranges only once they expire like the Redis entry
+    body = json.dumps(rows)
+    headers = {
+        "ETag": f'"{hashlib.sha1(body.encode()).hexdigest()}"',
+        "Cache-Control": f"private, max-age={ENERGY_CACHE_TTL}" if closed else "private, no-cache",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # Return energy consumption, query: view=hourly|daily|monthly, start_date, end_date
 @router.get("/energy", response_model=list[EnergyRead])
-def get_energy(view: ViewEnum, db: session = Depends(get_db), current_user: Account = Depends(admin_required), start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+def get_energy(request: Request, view: ViewEnum, db: session = Depends(get_db), current_user: Account = Depends(admin_required), start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
     try:
-        result = get_grouped_data(view, db, start_date=start_date, end_date=end_date)
-        return result
+        rows, closed = get_cached_grouped_data(view, db, start_date=start_date, end_date=end_date)
+        return energy_response(request, rows, closed)
     except ValueError as e:
         return {"error": str(e)}
     
 @router.get("/energy/{device_id}", response_model=list[EnergyRead])
-def get_energy_by_device_id(device_id: int, view: ViewEnum, db: session = Depends(get_db), current_user: Account = Depends(admin_required), start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+def get_energy_by_device_id(request: Request, device_id: int, view: ViewEnum, db: session = Depends(get_db), current_user: Account = Depends(admin_required), start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
     device = db.query(Status).filter(Status.unit_id == device_id).first()
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-    result = get_grouped_data(view, db, device_id, start_date, end_date)
-    return result
+    rows, closed = get_cached_grouped_data(view, db, device_id, start_date, end_date)
+    return energy_response(request, rows, closed)
\ No newline at end of file
@@ -1,11 +1,18 @@
 from datetime import datetime
 from typing import Optional
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from database import session
-from database.session import get_db
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from database.session import get_async_db
 from models.Account import Account, Permission, Role
 from models.Task import Task, TaskStatus, TaskType
+from models.unit import Unit
+from task_index import open_tasks
+from task_summary import read_summary, record_status_change
+from utils import decode_cursor, encode_cursor, estimated_count
 
 router = APIRouter(
     prefix='/tasks',
@@ -36,51 +43,96 @@ async def get_tasks(
     page_size: int = 10,
     type: str = None,
     status: str = None,
-    db: session = Depends(get_db)
+    cursor: Optional[str] = None,
+    exact_total: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = db.query(Task)
+    # Filters on the joined TaskType, the count joins it too
+    filters = []
     if type:
-        task_type = db.query(TaskType).filter(TaskType.value == type).first()
-        query = query.filter(Task.type == task_type)
+        filters.append(TaskType.value == type)
     if status:
-        status_enum = [statut for statut in TaskStatus if statut.value == status][0]
-        query = query.filter(Task.status == status_enum)
-
-    total = query.count()
-    tasks: list[Task] = query.order_by(Task.time.desc()).offset((page - 1) * page_size).limit(page_size).all()
-    tasks = [
-        TaskRead(
-            id=task.time,
-            time=task.time, 
-            device=task.device.name, 
-            type=task.type.value, 
-            status=task.status, 
-            assigned_to=Assignee(id=task.assignee.user_id, email=task.assignee.email) if task.assignee else None
+        try:
+            filters.append(Task.status == TaskStatus(status))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid status")
+
+    # Counting every match is a scan, by default only the unfiltered board gets an estimate
+    if exact_total:
+        total = await db.scalar(
+            select(func.count()).select_from(Task).join(TaskType, Task.type_id == TaskType.id).where(*filters)
         )
-        for task in tasks
-    ]
+    elif not filters:
+        total = await estimated_count(db, Task.__tablename__)
+    else:
+        total = None
+
+    # One joined query selecting only the columns of the listing
+    query = select(
+        Task.id,
+        Task.time,
+        Task.status,
+        Unit.name.label("device"),
+        TaskType.value.label("type"),
+        Account.user_id.label("assignee_id"),
+        Account.email.label("assignee_email"),
+    ).join(
+        Unit, Task.device_id == Unit.id
+    ).join(
+        TaskType, Task.type_id == TaskType.id
+    ).outerjoin(
+        Account, Task.assignee_id == Account.user_id
+    ).where(*filters)
+
+    # Served by ix_tasks_time_id
+    if cursor:
+        try:
+            time, task_id = decode_cursor(cursor)
+            query = query.where(tuple_(Task.time, Task.id) < tuple_(datetime.fromisoformat(time), int(task_id)))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    else:
+        query = query.offset((page - 1) * page_size)
+    rows = (await db.execute(query.order_by(Task.time.desc(), Task.id.desc()).limit(page_size))).all()
+    next_cursor = encode_cursor(rows[-1].time, rows[-1].id) if len(rows) == page_size else None
 
     return {
         "total": total,
         "page": page,
         "page_size": page_size,
-        "items": [TaskRead.model_validate(task) for task in tasks]
+        "items": [
+            TaskRead(
+                id=row.time,
+                time=row.time,
+                device=row.device,
+                type=row.type,
+                status=row.status.value,
+                assigned_to=Assignee(id=row.assignee_id, email=row.assignee_email) if row.assignee_id else None
+            )
+            for row in rows
+        ],
+        "next_cursor": next_cursor
     }
 
 # Get assignees
 @router.get("/assignees")
-async def get_assignees(db: session = Depends(get_db)):
+async def get_assignees(db: AsyncSession = Depends(get_async_db)):
     # Get all role ids that have the permission CONTROL_DEVICE and MONITOR_SYSTEM
-    role_ids = db.query(Role).filter(
+    role_ids = select(Role.role_id).where(
         Role.permissions.any(Permission.permission_name.in_(['GIÁM SÁT HỆ THỐNG', 'ĐIỀU KHIỂN THIẾT BỊ']))
-    ).all()
+    )
     # Get all accounts that have the role_id in the list
-    accounts: list[Account] = db.query(Account).filter(Account.role.in_([role.role_id for role in role_ids])).all()
+    accounts: list[Account] = (await db.scalars(select(Account).where(Account.role.in_(role_ids)))).all()
     
     return [
         Assignee(id=account.user_id, email=account.email) for account in accounts
     ]
 
+# Task counts by type and status, query: cluster_id
+@router.get("/summary")
+def get_task_summary(cluster_id: Optional[int] = None):
+    return read_summary(cluster_id)
+
 class TaskUpdate(BaseModel):
     status: str = None
     assignedTo: str = None
@@ -89,29 +141,42 @@ class TaskUpdate(BaseModel):
 async def update_task(
     task_id: datetime,
     task_update: TaskUpdate,
-    db: session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    task = db.query(Task).filter(Task.time == task_id).first()
+    task = await db.scalar(
+        select(Task).options(
+            joinedload(Task.device), joinedload(Task.type), joinedload(Task.assignee)
+        ).where(Task.time == task_id)
+    )
     if not task:
         return {"error": "Task not found"}
+    previous_status = task.status
     if task_update.status:
         status_enum = [status for status in TaskStatus if status.value == task_update.status][0]
         task.status = status_enum
 
     if task_update.assignedTo:
-        assignee = db.query(Account).filter(Account.user_id == task_update.assignedTo).first()
+        assignee = await db.scalar(select(Account).where(Account.user_id == task_update.assignedTo))
         if not assignee:
             return {"error": "Assignee not found"}
         task.assignee = assignee
 
-    db.commit()
-    db.refresh(task)
+    # Attributes stay loaded after the commit, no refresh needed
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Reopening a task while another one of the same type is open for the device
+        await db.rollback()
+        return {"error": "The device already has an open task of this type"}
+    if task.status == TaskStatus.COMPLETED:
+        open_tasks.discard(task.device_id, task.type_id)
+    record_status_change(task.type.key, previous_status, task.status, task.device.cluster_id)
 
     return TaskRead(
         id=task.time,
         time=task.time,
         device=task.device.name,
-        type=task.type,
-        status=task.status,
+        type=task.type.value,
+        status=task.status.value,
         assigned_to=Assignee(id=task.assignee.user_id, email=task.assignee.email) if task.assignee else None
-    )
\ No newline at end of file
+    )
@@ -1,7 +1,8 @@
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
-from auth import get_current_user
+from auth import get_current_user, principal_cache
+from rbac import rbac
 from database import session
 from .dependencies import required_permission
 from config import PermissionEnum
@@ -40,7 +41,7 @@ def create_user(
     db.commit()
     db.refresh(new_user)
     # Create audit log
-    save_audit_log(db, current_user.email, ActionEnum.CREATE, f"Tạo {new_user.username}")
+    save_audit_log(current_user, ActionEnum.CREATE, f"Tạo {new_user.username}")
     
     return UserRead(
         user_id=new_user.user_id,
@@ -77,7 +78,7 @@ def get_users_with_role(db: session) -> list[UserRead]:
 
 def protect_admin(db: session, current_user: Account, target_user_id: int):
     # Get role name of the target user
-    current_role_name = db.query(Role).filter(Role.role_id == current_user.role).first().role_name
+    current_role_name = rbac.role_name(current_user.role)
     target_role_name = db.query(Role).join(Account).filter(Account.user_id == target_user_id).first().role_name
     return current_role_name not in ["ADMIN", "SUPERADMIN"] and target_role_name in ["ADMIN", "SUPERADMIN"]
 
@@ -135,8 +136,9 @@ def update_user(
             setattr(user, key, value)
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate_user(user_id)
     # Create audit log
-    save_audit_log(db, email=current_user.email, action=ActionEnum.UPDATE, details=f"Cập nhật {user.username}")
+    save_audit_log(current_user, action=ActionEnum.UPDATE, details=f"Cập nhật {user.username}")
     return user
 
 ## PATCH ##
@@ -165,8 +167,9 @@ def patch_user(
             
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate_user(user_id)
     # Create audit log
-    save_audit_log(db, email=current_user.email, action=ActionEnum.UPDATE, details=f"Cập nhật {user.username}")
+    save_audit_log(current_user, action=ActionEnum.UPDATE, details=f"Cập nhật {user.username}")
     return UserRead(
         user_id=user.user_id,
         email=user.email,
@@ -194,10 +197,10 @@ def delete_user(
         raise HTTPException(status_code=403, detail="You cannot delete yourself.")
     db.delete(user)
     db.commit()
+    principal_cache.invalidate_user(user_id)
     # Create audit log
     save_audit_log(
-        db,
-        email=current_user.email, 
+        current_user, 
         action=ActionEnum.DELETE, 
         details=f"Xóa {user.username}")
 
@@ -228,8 +231,9 @@ def create_role(
     # Set the permission relationship with actual Permission instances
     new_role.permissions = permissions
     db.commit()
+    rbac.bump()
     # Add to audit log
-    save_audit_log(db, current_user.email, ActionEnum.CREATE, f"Tạo chức vụ {new_role.role_name}")
+    save_audit_log(current_user, ActionEnum.CREATE, f"Tạo chức vụ {new_role.role_name}")
     return RoleRead(
         role_id=new_role.role_id,
         role_name=new_role.role_name
@@ -261,8 +265,9 @@ def update_role(
             setattr(role, key, value)  # For regular fields
     db.commit()
     db.refresh(role)
+    rbac.bump()
     # Add to audit log
-    save_audit_log(db, current_user.email, ActionEnum.UPDATE, f"Cập nhật chức vụ {role.role_name}")
+    save_audit_log(current_user, ActionEnum.UPDATE, f"Cập nhật chức vụ {role.role_name}")
     return role
 
 @router.delete("/role/{role_id}")
@@ -278,8 +283,9 @@ def delete_role(role_id: int, current_user: Account = Depends(get_current_user)
         raise HTTPException(status_code=403, detail="Cannot delete role with users")
     db.delete(role)
     db.commit()
+    rbac.bump()
     # Add to audit log
-    save_audit_log(db, current_user.email, ActionEnum.DELETE, f"Xóa chức vụ {role.role_name}")
+    save_audit_log(current_user, ActionEnum.DELETE, f"Xóa chức vụ {role.role_name}")
     return {"detail": "Role deleted successfully"}
 
 class PasswordChange(BaseModel):
@@ -292,8 +298,8 @@ def change_password(
     db: session = Depends(session.get_db),
     current_user: Account = Depends(get_current_user)
 ):
-    # If user_id not provided, change own password
-    target_user = current_user if user_id is None else db.query(Account).filter(Account.user_id == user_id).first()
+    # If user_id not provided, change own password. current_user is not attached to the session, load it.
+    target_user = db.query(Account).filter(Account.user_id == (current_user.user_id if user_id is None else user_id)).first()
     
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -301,8 +307,8 @@ def change_password(
     # Allow self password change or check permissions for other users
     if target_user.user_id != current_user.user_id:
         # Get roles to compare ranks
-        current_role: Role = db.query(Role).filter(Role.role_id == current_user.role).first()
-        target_role: Role = db.query(Role).filter(Role.role_id == target_user.role).first()
+        current_role = rbac.get(current_user.role)
+        target_role = rbac.get(target_user.role)
         
         # Check if current user has higher rank
         if not current_role or not target_role or current_role.rank >= target_role.rank:
@@ -316,13 +322,14 @@ def change_password(
     target_user.password = hashed_pwd
     
     db.commit()
+    principal_cache.invalidate_user(target_user.user_id)
     
     # Create audit log
     action_desc = (
         f"Thay đổi mật khẩu của tài khoản {target_user.username}" 
-        if target_user != current_user 
+        if target_user.user_id != current_user.user_id 
         else "Tự thay đổi mật khẩu"
     )
-    save_audit_log(db, current_user.email, ActionEnum.UPDATE, action_desc)
+    save_audit_log(current_user, ActionEnum.UPDATE, action_desc)
 
     return {"message": "Password updated successfully"}
\ No newline at end of file
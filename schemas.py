@@ -128,6 +128,15 @@ class Cluster(ClusterBase):
     class Config:
         orm_mode: True
 
+class UnitSnapshot(BaseModel):
+    id: int
+    name: str
+    cluster_id: Optional[int] = None
+    power: Optional[float] = None
+    toggle: Optional[bool] = None
+    alive: bool
+    last_seen: Optional[datetime] = None
+
 class Schedule(BaseModel):
     hourOn: int
     minuteOn: int
@@ -0,0 +1,194 @@
+# status_writer.py
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import datetime
+import redis
+from sqlalchemy.dialects.postgresql import insert
+from database import engine, insert_batch
+from models.Status import Status
+from redis_client import client as redis_client
+from config import (
+    STATUS_BATCH_SIZE, STATUS_FLUSH_INTERVAL, STATUS_STREAM_MAXLEN, STATUS_STREAM_MAX_AGE,
+    STATUS_STREAM_CLAIM_IDLE, STATUS_WRITER_CONSUMERS, STATUS_RETRY_MAX_INTERVAL
+)
+
+STATUS_STREAM = "status:stream"
+STATUS_GROUP = "status-writers"
+
+class StatusWriter:
+    """
+    Durable, batched writer for the status readings of the MQTT ingest path.
+
+    `write` appends the reading to a Redis stream, capped by length or age.
+    Consumer threads of the `status-writers` group read the stream in batches
+    of up to `batch_size` entries, insert each batch with one multi-row
+    INSERT ... ON CONFLICT DO NOTHING and acknowledge the entries only after
+    the commit. After a failed insert a consumer backs off, up to
+    `retry_max_interval` seconds, and writes its own pending entries again
+    before reading new ones. Entries left pending by a crashed consumer are
+    reclaimed once idle for `claim_idle` seconds, walking the whole pending
+    list. Writers can run in the ingest process or on their own with
+    `python status_writer.py`.
+    """
+    def __init__(self, batch_size: int = STATUS_BATCH_SIZE, flush_interval: float = STATUS_FLUSH_INTERVAL,
+                 consumers: int = STATUS_WRITER_CONSUMERS, claim_idle: int = STATUS_STREAM_CLAIM_IDLE,
+                 retry_max_interval: float = STATUS_RETRY_MAX_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.consumers = consumers
+        self.claim_idle = claim_idle
+        self.retry_max_interval = retry_max_interval
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self._threads: list[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "flushes": 0,
+            "rows_written": 0,
+            "rows_failed": 0,
+            "rows_reclaimed": 0,
+            "rows_trimmed": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def start(self):
+        if self._threads or self.consumers <= 0:
+            return
+        try:
+            redis_client.xgroup_create(STATUS_STREAM, STATUS_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            # The group already exists
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._run, args=(f"{self.name}-{index}",), name=f"status-writer-{index}", daemon=True)
+            for index in range(self.consumers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        # Consumers finish their current batch, whatever is not acknowledged stays in the stream
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def write(self, row: dict):
+        fields = {"row": json.dumps(row, default=datetime.isoformat)}
+        try:
+            if STATUS_STREAM_MAX_AGE:
+                min_id = int((time.time() - STATUS_STREAM_MAX_AGE) * 1000)
+                redis_client.xadd(STATUS_STREAM, fields, minid=min_id, approximate=True)
+            else:
+                redis_client.xadd(STATUS_STREAM, fields, maxlen=STATUS_STREAM_MAXLEN, approximate=True)
+        except redis.RedisError as e:
+            # Without the buffer, write straight to the database rather than lose the reading
+            print(f"Status stream unavailable, writing directly: {e}")
+            self._insert([row])
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / stats["flushes"] if stats["flushes"] else 0.0
+        try:
+            stats["stream_length"] = redis_client.xlen(STATUS_STREAM)
+            stats["pending"] = redis_client.xpending(STATUS_STREAM, STATUS_GROUP)["pending"]
+        except redis.RedisError:
+            stats["stream_length"] = stats["pending"] = None
+        return stats
+
+    def _run(self, consumer: str):
+        # The pending entries of this consumer, left by a failed insert, are written before new ones
+        pending = True
+        interval = self.flush_interval
+        last_claim = 0.0
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() - last_claim > self.claim_idle:
+                    last_claim = time.monotonic()
+                    self._reclaim(consumer)
+                response = redis_client.xreadgroup(
+                    STATUS_GROUP, consumer, {STATUS_STREAM: "0" if pending else ">"},
+                    count=self.batch_size, block=None if pending else int(self.flush_interval * 1000)
+                )
+                entries = response[0][1] if response else []
+                if entries:
+                    self._flush(entries)
+                else:
+                    pending = False
+                interval = self.flush_interval
+            except Exception as e:
+                # Retry the same entries rather than move the stream to the pending list while the database is down
+                print(f"Error writing statuses, retrying in {interval:g}s: {e}")
+                pending = True
+                self._stopping.wait(interval)
+                interval = min(interval * 2, self.retry_max_interval)
+
+    def _reclaim(self, consumer: str):
+        # Walk the pending list of the group with the cursor of XAUTOCLAIM, entries of crashed consumers are written here
+        start_id = "0-0"
+        while not self._stopping.is_set():
+            start_id, entries, _ = redis_client.xautoclaim(
+                STATUS_STREAM, STATUS_GROUP, consumer,
+                min_idle_time=self.claim_idle * 1000, start_id=start_id, count=self.batch_size
+            )
+            if entries:
+                self._count("rows_reclaimed", len(entries))
+                self._flush(entries)
+            if start_id in (b"0-0", "0-0"):
+                break
+
+    def _flush(self, entries: list):
+        ids = [entry_id for entry_id, _ in entries]
+        # Pending entries trimmed from the stream come back without fields, they are only acknowledged
+        rows = [self._decode(fields) for _, fields in entries if fields]
+        self._count("rows_trimmed", len(entries) - len(rows))
+        written = len(rows)
+        start = time.perf_counter()
+        failed = insert_batch(self._insert, rows, lambda row: f"status of unit {row.get('unit_id')}") if rows else 0
+        redis_client.xack(STATUS_STREAM, STATUS_GROUP, *ids)
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["rows_written"] += written - failed
+            self._stats["rows_failed"] += failed
+            self._stats["last_batch_size"] = written
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], written)
+            self._stats["last_flush_ms"] = elapsed
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed)
+            self._stats["total_flush_ms"] += elapsed
+
+    def _insert(self, rows: list[dict]):
+        # Duplicate (unit, time) readings are silently skipped by the database
+        with engine.begin() as connection:
+            connection.execute(insert(Status).on_conflict_do_nothing(), rows)
+
+    def _decode(self, fields: dict) -> dict:
+        row = json.loads(fields[b"row"])
+        row["time"] = datetime.fromisoformat(row["time"])
+        return row
+
+    def _count(self, key: str, value: int):
+        with self._lock:
+            self._stats[key] += value
+
+status_writer = StatusWriter()
+
+if __name__ == "__main__":
+    # Standalone database writer, scaled independently of the ingest service
+    stopping = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    status_writer.start()
+    print(f"Status writer started with {status_writer.consumers} consumers")
+    stopping.wait()
+    status_writer.stop()
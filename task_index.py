@@ -0,0 +1,76 @@
+# task_index.py
+import threading
+import time
+import redis
+from database import SessionLocal
+from models.Task import Task, TaskStatus, TaskType, TaskTypeEnum
+from redis_client import client as redis_client
+from redis_listener import RedisListener
+from config import OPEN_TASK_TTL
+
+# Tasks completed through the API are announced here so the ingest processes drop them from their index
+TASK_CLOSED_CHANNEL = "tasks:closed"
+
+class OpenTaskIndex:
+    """
+    Process-local index of open tasks keyed by (device_id, type_id), with the TaskType ids.
+
+    add_task consults it to skip the database while a task is already open,
+    which for a faulty unit is on every status message. The partial unique
+    index ix_tasks_open_device_type is what prevents duplicates, the index is
+    only a cache in front of it: entries are trusted for `ttl` seconds, so a
+    missed announcement delays a new task by at most that long. The index is
+    reloaded once the subscription is re-established after a Redis error.
+    """
+    def __init__(self, ttl: int = OPEN_TASK_TTL):
+        self.ttl = ttl
+        self._type_ids: dict[TaskTypeEnum, int] = {}
+        self._open: dict[tuple[int, int], float] = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def load(self):
+        with SessionLocal() as session:
+            types = session.query(TaskType.id, TaskType.key).all()
+            open_tasks = session.query(Task.device_id, Task.type_id).filter(
+                Task.status != TaskStatus.COMPLETED
+            ).all()
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._type_ids = {TaskTypeEnum[key]: type_id for type_id, key in types if key in TaskTypeEnum.__members__}
+            self._open = {(device_id, type_id): expires for device_id, type_id in open_tasks}
+        print(f"Loaded {len(open_tasks)} open tasks into the index")
+
+    def listen(self):
+        # Drop tasks completed by other processes, on a background thread
+        if self._listener:
+            return
+        self._listener = RedisListener("open-tasks", {TASK_CLOSED_CHANNEL: self._on_closed}, on_reconnect=self.load)
+        self._listener.start()
+
+    def type_id(self, type: TaskTypeEnum) -> int | None:
+        if type not in self._type_ids:
+            self.load()
+        return self._type_ids.get(type)
+
+    def is_open(self, device_id: int, type_id: int) -> bool:
+        return self._open.get((device_id, type_id), 0) > time.monotonic()
+
+    def add(self, device_id: int, type_id: int):
+        with self._lock:
+            self._open[(device_id, type_id)] = time.monotonic() + self.ttl
+
+    def discard(self, device_id: int, type_id: int, announce: bool = True):
+        with self._lock:
+            self._open.pop((device_id, type_id), None)
+        if announce:
+            try:
+                redis_client.publish(TASK_CLOSED_CHANNEL, f"{device_id}:{type_id}")
+            except redis.RedisError as e:
+                print(f"Error announcing closed task: {e}")
+
+    def _on_closed(self, message):
+        device_id, type_id = message["data"].decode().split(":")
+        self.discard(int(device_id), int(type_id), announce=False)
+
+open_tasks = OpenTaskIndex()
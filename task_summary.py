@@ -0,0 +1,119 @@
+# task_summary.py
+import threading
+import redis
+from sqlalchemy import func
+from database import SessionLocal
+from models.Task import Task, TaskStatus, TaskType, TaskTypeEnum
+from models.unit import Unit
+from redis_client import client as redis_client
+from config import TASK_SUMMARY_RECONCILE_INTERVAL
+
+# Hash of task counts, one field per type:status:cluster
+TASK_SUMMARY_KEY = "tasks:summary"
+# Held by the process reconciling the counters, so only one does per interval
+TASK_SUMMARY_LOCK = "tasks:summary:lock"
+
+def summary_field(type_key: str, status: TaskStatus, cluster_id: int | None) -> str:
+    return f"{type_key}:{status.name}:{cluster_id if cluster_id is not None else ''}"
+
+def record_created(type: TaskTypeEnum, cluster_id: int | None):
+    # New tasks are PENDING
+    try:
+        redis_client.hincrby(TASK_SUMMARY_KEY, summary_field(type.name, TaskStatus.PENDING, cluster_id), 1)
+    except redis.RedisError as e:
+        print(f"Error counting task: {e}")
+
+def record_status_change(type_key: str, previous: TaskStatus, status: TaskStatus, cluster_id: int | None):
+    if previous == status:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(TASK_SUMMARY_KEY, summary_field(type_key, previous, cluster_id), -1)
+        pipe.hincrby(TASK_SUMMARY_KEY, summary_field(type_key, status, cluster_id), 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error counting task: {e}")
+
+def count_tasks() -> dict[str, int]:
+    # The counters as computed from the table
+    with SessionLocal() as session:
+        rows = session.query(
+            TaskType.key, Task.status, Unit.cluster_id, func.count()
+        ).join(
+            TaskType, Task.type_id == TaskType.id
+        ).join(
+            Unit, Task.device_id == Unit.id
+        ).group_by(
+            TaskType.key, Task.status, Unit.cluster_id
+        ).all()
+    return {summary_field(type_key, status, cluster_id): count for type_key, status, cluster_id, count in rows}
+
+def read_summary(cluster_id: int | None = None) -> dict[str, dict[str, int]]:
+    """
+    Task counts by type and status, of every cluster or of one.
+
+    Served from the Redis counters in one HGETALL, or from the table when
+    Redis is unavailable. Types and statuses are keyed by their value, like
+    the task listing.
+    """
+    try:
+        counters = {field.decode(): int(count) for field, count in redis_client.hgetall(TASK_SUMMARY_KEY).items()}
+    except redis.RedisError as e:
+        print(f"Task summary unavailable, counting tasks: {e}")
+        counters = count_tasks()
+    summary = {type.value: {status.value: 0 for status in TaskStatus} for type in TaskTypeEnum}
+    for field, count in counters.items():
+        type_key, status_name, cluster = field.split(":")
+        if cluster_id is not None and cluster != str(cluster_id):
+            continue
+        if type_key in TaskTypeEnum.__members__ and status_name in TaskStatus.__members__:
+            summary[TaskTypeEnum[type_key].value][TaskStatus[status_name].value] += count
+    return summary
+
+class TaskSummaryReconciler:
+    """
+    Periodically replaces the task counters with counts from the table.
+
+    The counters are maintained incrementally by add_task and update_task and
+    can drift, for instance when Redis was unavailable. Every `interval`
+    seconds one process, holding a Redis lock, recounts the table and swaps
+    the hash in a transaction.
+    """
+    def __init__(self, interval: int = TASK_SUMMARY_RECONCILE_INTERVAL):
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="task-summary", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def reconcile(self):
+        counters = count_tasks()
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(TASK_SUMMARY_KEY)
+        if counters:
+            pipe.hset(TASK_SUMMARY_KEY, mapping=counters)
+        pipe.execute()
+
+    def _run(self):
+        # Reconcile at startup, then every interval
+        while not self._stopping.is_set():
+            try:
+                # The lock expires with the interval, so it is never released explicitly
+                if redis_client.set(TASK_SUMMARY_LOCK, 1, nx=True, ex=self.interval):
+                    self.reconcile()
+            except Exception as e:
+                print(f"Error reconciling task summary: {e}")
+            self._stopping.wait(self.interval)
+
+task_summary_reconciler = TaskSummaryReconciler()
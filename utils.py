@@ -1,11 +1,18 @@
 # utils.py
 
+import base64
+import binascii
+import json
 from datetime import datetime
 from passlib.context import CryptContext
 import pytz
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
 from models.Account import Account
-from models.Audit import Audit
-from models.Task import TaskType, TaskTypeEnum
+from models.Audit import ActionEnum
+from audit_writer import audit_writer
+from rbac import rbac
+from models.Task import TaskStatus, TaskTypeEnum
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -15,14 +22,11 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
-def save_audit_log(db, email: str, action: str, details: str):
-    user = db.query(Account).filter(Account.email == email).first()
-    if user.role_rel.role_name == "SUPERADMIN":
-        return None
-    audit = Audit(email=email, action=action, details=details)
-    db.add(audit)
-    db.commit()
-    return audit
+def save_audit_log(user: Account, action: ActionEnum, details: str):
+    # Queued for the audit writer, SUPERADMIN actions are not audited
+    if rbac.role_name(user.role) == "SUPERADMIN":
+        return
+    audit_writer.write(user.email, action, details)
 
 def get_tz_datetime(timestamp: int | None = None) -> datetime:
     if not timestamp:
@@ -33,30 +37,52 @@ def get_tz_datetime(timestamp: int | None = None) -> datetime:
         time = utc_dt.replace(tzinfo=pytz.FixedOffset(420))
         return time
 
+# Listings page with an opaque keyset cursor, the sort key of the last row of a page: the next
+# page is read with the cursor of the previous one, without an OFFSET that scans the skipped rows.
+# Requests without a cursor still page by offset, for older clients.
+def encode_cursor(*values) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str) -> list:
+    # Raises ValueError for a malformed cursor
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+async def estimated_count(db, table: str) -> int | None:
+    # Row estimate maintained by ANALYZE/autovacuum, None when the table was never analysed
+    estimate = await db.scalar(text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table})
+    return estimate if estimate is not None and estimate >= 0 else None
+
 def add_task(device_id: int, type: TaskTypeEnum):
-    from models.Task import Task, TaskStatus
-    from database.__init__ import SessionLocal
+    from models.Task import Task
+    from database.__init__ import engine
+    from task_index import open_tasks
+    from task_summary import record_created
+    from device_registry import device_registry
 
-    session = SessionLocal()
+    type_id = open_tasks.type_id(type)
+    # Skip the database while the task is known to be open
+    if type_id is None or open_tasks.is_open(device_id, type_id):
+        return
     try:
-        # Check if there is an unresolved task for the device with the same type
-        task_type = session.query(TaskType).filter(TaskType.value == type.value).first()
-        existing_task = session.query(Task).filter(
-            Task.device_id == device_id, 
-            Task.type == task_type,
-            Task.status != TaskStatus.COMPLETED).first()
-        
-        if existing_task:
-            session.close()
-            return
-        task = Task(
-            device_id=device_id,
-            type=task_type
-        )
-        session.add(task)
-        session.commit()
+        # The partial unique index keeps a single open task per device and type
+        with engine.begin() as connection:
+            result = connection.execute(
+                insert(Task).values(device_id=device_id, type_id=type_id).on_conflict_do_nothing(
+                    index_elements=[Task.device_id, Task.type_id],
+                    index_where=Task.status != TaskStatus.COMPLETED
+                )
+            )
+        open_tasks.add(device_id, type_id)
+        # Only count the task when it was not already open
+        if result.rowcount:
+            device = device_registry.get_by_id(device_id)
+            record_created(type, device.cluster_id if device else None)
     except Exception as e:
-        session.rollback()
         print(f"Error adding task: {e}")
-    finally:
-        session.close()
\ No newline at end of file
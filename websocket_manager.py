@@ -1,47 +1,172 @@
-from datetime import datetime
+import asyncio
 import enum
+import time
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, List
+import json
+from typing import Dict, Set
 from auth import ws_get_current_user
-from config import PermissionEnum
+from config import PermissionEnum, WS_QUEUE_SIZE, WS_SEND_TIMEOUT
 from models.Account import Account
-from redis_client import client as redis_client
-from database import SessionLocal
+from database import AsyncSessionLocal
+from device_registry import device_registry
+import device_state
+
+stats = {
+    "evicted_overflow": 0,
+    "evicted_timeout": 0,
+    "send_errors": 0,
+    "fanouts": 0,
+    "last_fanout_ms": 0.0,
+    "max_fanout_ms": 0.0,
+    "last_delivery_ms": 0.0,
+    "max_delivery_ms": 0.0,
+}
+
+def record_fanout(started: float):
+    elapsed = (time.perf_counter() - started) * 1000
+    stats["fanouts"] += 1
+    stats["last_fanout_ms"] = elapsed
+    stats["max_fanout_ms"] = max(stats["max_fanout_ms"], elapsed)
+
+class Outbox:
+    """
+    Bounded outbound queue of a WebSocket, drained by its own writer task.
+
+    Senders only enqueue, so a stalled client never delays the others. A
+    connection whose queue overflows or whose send takes longer than
+    `timeout` seconds is closed and `on_close` is called to evict it.
+    """
+    def __init__(self, websocket: WebSocket, on_close, maxsize: int = WS_QUEUE_SIZE, timeout: float = WS_SEND_TIMEOUT):
+        self.websocket = websocket
+        self.on_close = on_close
+        self.timeout = timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.closed = False
+        self.task = asyncio.create_task(self._run())
+
+    def send(self, message: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait((message, time.perf_counter()))
+        except asyncio.QueueFull:
+            stats["evicted_overflow"] += 1
+            self.close()
+            return False
+        return True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        asyncio.create_task(self._close_socket())
+        self.on_close(self.websocket)
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=1013, reason="Client too slow")
+        except Exception:
+            # Already closed by the client
+            pass
+
+    async def _run(self):
+        try:
+            while True:
+                message, queued_at = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(message), self.timeout)
+                elapsed = (time.perf_counter() - queued_at) * 1000
+                stats["last_delivery_ms"] = elapsed
+                stats["max_delivery_ms"] = max(stats["max_delivery_ms"], elapsed)
+        except asyncio.TimeoutError:
+            stats["evicted_timeout"] += 1
+        except Exception:
+            stats["send_errors"] += 1
+        self.close()
 
 class WebSocketManager:
     def __init__(self):
-        # Maintain a dictionary where each unit_id maps to a list of WebSocket connections
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        # Maintain a dictionary where each unit_id maps to the WebSocket connections subscribed to it
+        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        # Reverse index: the unit_ids each connection is subscribed to
+        self.subscriptions: Dict[WebSocket, Set[str]] = {}
+        # Connections from the multiplexed endpoint, which receive messages tagged with the unit_id
+        self.multiplexed: Set[WebSocket] = set()
+        self.outboxes: Dict[WebSocket, Outbox] = {}
 
     async def connect(self, websocket: WebSocket, unit_id: str):
         await websocket.accept()
+        self.outboxes[websocket] = Outbox(websocket, self.disconnect)
         unit_id = str(unit_id)
-        # If the unit_id doesn't exist, create an entry for it
-        if unit_id not in self.active_connections:
-            self.active_connections[unit_id] = []
-        self.active_connections[unit_id].append(websocket)
-        previous_status = redis_client.get(f"device:{unit_id}")
-        if previous_status:
-            await websocket.send_text(previous_status.decode('utf-8'))
-        else:
-            # Send the disconnected status to the client with time as current time
-            await websocket.send_json(
-                {"alive": 0, "time": datetime.now().isoformat()}
-            )
-        
-    def disconnect(self, websocket: WebSocket, unit_id: str):
-        # Remove the websocket from the list of connections for this unit_id
-        self.active_connections[str(unit_id)].remove(websocket)
-        # If no more connections exist for this unit_id, delete the entry
-        if not self.active_connections[str(unit_id)]:
-            del self.active_connections[str(unit_id)]
+        self.subscribe(websocket, [unit_id])
+        # The last telemetry, or the disconnected status when the unit is offline
+        self.send(websocket, device_state.read_messages([unit_id])[0])
+
+    async def connect_multiplexed(self, websocket: WebSocket):
+        await websocket.accept()
+        self.outboxes[websocket] = Outbox(websocket, self.disconnect)
+        self.multiplexed.add(websocket)
+        self.subscriptions[websocket] = set()
+
+    def send(self, websocket: WebSocket, message: str):
+        # Every message to a connection goes through its outbox, so they are sent in order
+        outbox = self.outboxes.get(websocket)
+        if outbox:
+            outbox.send(message)
+
+    def subscribe(self, websocket: WebSocket, unit_ids: list[str]) -> list[str]:
+        # Returns the unit_ids the connection was not subscribed to yet
+        subscribed = self.subscriptions.setdefault(websocket, set())
+        added = [unit_id for unit_id in dict.fromkeys(unit_ids) if unit_id not in subscribed]
+        for unit_id in added:
+            subscribed.add(unit_id)
+            self.active_connections.setdefault(unit_id, set()).add(websocket)
+        return added
+
+    def unsubscribe(self, websocket: WebSocket, unit_ids: list[str]):
+        subscribed = self.subscriptions.get(websocket, set())
+        for unit_id in unit_ids:
+            if unit_id not in subscribed:
+                continue
+            subscribed.remove(unit_id)
+            connections = self.active_connections[unit_id]
+            connections.discard(websocket)
+            # If no more connections exist for this unit_id, delete the entry
+            if not connections:
+                del self.active_connections[unit_id]
+
+    def disconnect(self, websocket: WebSocket, unit_id: str | None = None):
+        # Remove the websocket from every unit it is subscribed to
+        self.unsubscribe(websocket, list(self.subscriptions.get(websocket, ())))
+        self.subscriptions.pop(websocket, None)
+        self.multiplexed.discard(websocket)
+        outbox = self.outboxes.pop(websocket, None)
+        if outbox:
+            outbox.close()
+
+    async def send_snapshot(self, websocket: WebSocket, unit_ids: list[str]):
+        # Fetch the last known state of every unit in one round-trip
+        if not unit_ids:
+            return
+        # The stored messages are embedded as they are, without parsing them
+        messages = device_state.read_messages(unit_ids)
+        units = ", ".join(f"{json.dumps(unit_id)}: {message}" for unit_id, message in zip(unit_ids, messages))
+        self.send(websocket, f'{{"type": "snapshot", "units": {{{units}}}}}')
 
     async def send_private_message(self, message: str, unit_id: str):
         unit_id = str(unit_id)
-        # Send the message only to connections for the specified unit_id
+        # Send the message only to connections for the specified unit_id.
+        # Messages are only queued here, the outbox writers do the network I/O.
         if unit_id in self.active_connections:
-            for connection in self.active_connections[unit_id]:
-                await connection.send_text(message)
+            started = time.perf_counter()
+            tagged = f'{{"type": "update", "unit_id": {json.dumps(unit_id)}, "data": {message}}}'
+            for connection in list(self.active_connections[unit_id]):
+                self.send(connection, tagged if connection in self.multiplexed else message)
+            record_fanout(started)
+
+    def queue_depths(self) -> list[int]:
+        return [outbox.queue.qsize() for outbox in self.outboxes.values()]
 
 class NOTI_TYPE (enum.Enum):
     INFO = "INFO"
@@ -64,20 +189,25 @@ class Notification:
 class NotificationManager:
     def __init__(self):
         self.notifications: list[Notification] = []
-        self.active_connections: list[WebSocket] = []
+        self.active_connections: Dict[WebSocket, Outbox] = {}
 
     async def connect(self, websocket: WebSocket, current_user: Account):
         # Add the websocket to the set of active connections
         if current_user is None:
             return
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections[websocket] = Outbox(websocket, self.evict)
         if self.get_notifications():
-            await websocket.send_json(self.get_notifications())
+            self.active_connections[websocket].send(json.dumps(self.get_notifications()))
 
     async def disconnect(self, websocket: WebSocket):
         # Remove the websocket from the set of active connections
-        self.active_connections.remove(websocket)
+        self.evict(websocket)
+
+    def evict(self, websocket: WebSocket):
+        outbox = self.active_connections.pop(websocket, None)
+        if outbox:
+            outbox.close()
 
     def add_notification(self, notification: Notification):
         self.notifications.append(notification)
@@ -92,13 +222,20 @@ class NotificationManager:
         self.notifications = []
 
     async def broadcast_all(self):
-        notifications = self.get_notifications()
-        for connection in self.active_connections:
-            await connection.send_json(notifications)
+        self._broadcast(json.dumps(self.get_notifications()))
 
     async def broadcast(self, notification: Notification):
-        for connection in self.active_connections:
-            await connection.send_json([notification.to_json()])
+        self._broadcast(json.dumps([notification.to_json()]))
+
+    def _broadcast(self, message: str):
+        # Only queue the message, the outbox writers do the network I/O
+        started = time.perf_counter()
+        for outbox in list(self.active_connections.values()):
+            outbox.send(message)
+        record_fanout(started)
+
+    def queue_depths(self) -> list[int]:
+        return [outbox.queue.qsize() for outbox in self.active_connections.values()]
 
     async def send_notification(self, notification: Notification):
         self.add_notification(notification)
@@ -108,6 +245,15 @@ class NotificationManager:
 manager = WebSocketManager()
 notification_manager = NotificationManager()
 
+def websocket_stats() -> dict:
+    depths = manager.queue_depths() + notification_manager.queue_depths()
+    return dict(
+        stats,
+        connections=len(depths),
+        queued=sum(depths),
+        max_queue_depth=max(depths, default=0),
+    )
+
 async def websocket_endpoint(websocket: WebSocket, unit_id: str):
     await manager.connect(websocket, unit_id)
     try:
@@ -119,14 +265,40 @@ async def websocket_endpoint(websocket: WebSocket, unit_id: str):
 async def notification(websocket: WebSocket, token: str):
     # Get the db session
     try:
-        with SessionLocal() as db:
-            current_user = ws_get_current_user(
-                token, 
-                db, 
-                required_permission=[PermissionEnum.CONTROL_DEVICE, PermissionEnum.MONITOR_SYSTEM]
+        async with AsyncSessionLocal() as db:
+            current_user = await db.run_sync(
+                lambda session: ws_get_current_user(
+                    token, 
+                    session, 
+                    required_permission=[PermissionEnum.CONTROL_DEVICE, PermissionEnum.MONITOR_SYSTEM]
+                )
             )
-            await notification_manager.connect(websocket, current_user)
+        await notification_manager.connect(websocket, current_user)
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        await notification_manager.disconnect(websocket)
\ No newline at end of file
+        await notification_manager.disconnect(websocket)
+
+async def multiplexed_endpoint(websocket: WebSocket):
+    # Clients send {"action": "subscribe" | "unsubscribe", "units": [...], "clusters": [...]}
+    await manager.connect_multiplexed(websocket)
+    try:
+        while True:
+            try:
+                request = await websocket.receive_json()
+                unit_ids = [str(unit_id) for unit_id in request.get("units", [])]
+                for cluster_id in request.get("clusters", []):
+                    unit_ids += [str(device.id) for device in device_registry.get_by_cluster(int(cluster_id))]
+            except (ValueError, TypeError, AttributeError):
+                manager.send(websocket, json.dumps({"type": "error", "detail": "Invalid subscription request"}))
+                continue
+            action = request.get("action")
+            if action == "subscribe":
+                added = manager.subscribe(websocket, unit_ids)
+                await manager.send_snapshot(websocket, added)
+            elif action == "unsubscribe":
+                manager.unsubscribe(websocket, unit_ids)
+            else:
+                manager.send(websocket, json.dumps({"type": "error", "detail": "Invalid action"}))
+    except WebSocketDisconnect:
+        manager.disconnect(websocket)
\ No newline at end of file